@@ -0,0 +1,262 @@
+import asyncio
+import io
+import zipfile
+from dataclasses import dataclass
+from pathlib import PurePosixPath
+from typing import Any, Iterable, List, Optional, Set, Tuple
+
+from asyncpg import Connection
+from loguru import logger
+
+from app.heatmap import update_heatmap
+from app.ingest import IngestError, slugify_name, track_details
+from app.render_pool import run_in_pool
+from app.settings import settings
+from app.stats import store_track_stats
+from app.thumbnails import render_params
+from app.versions import bump_data_version
+
+
+class BatchError(Exception):
+    pass
+
+
+@dataclass
+class BatchItem:
+    filename: str
+    data: Optional[bytes] = None
+    # an app.gpx.PreparedTrack once parsed
+    track: Optional[Any] = None
+    slug: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BatchBudget:
+    # what's left of a batch's limits, taken from as files are unpacked so an
+    # archive is stopped before it inflates past them rather than after
+    def __init__(self):
+        self.files = settings.batch_max_files
+        self.bytes = settings.batch_max_bytes
+
+    def take(self, size: int):
+        self.files -= 1
+        self.bytes -= size
+
+        if self.files < 0:
+            raise BatchError(
+                f"A batch can have at most {settings.batch_max_files} files"
+            )
+
+        if self.bytes < 0:
+            raise BatchError("Batch is too large once unzipped")
+
+
+def expand_archive(filename: str, data: bytes, budget: BatchBudget) -> List[BatchItem]:
+    items = []
+
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            for info in archive.infolist():
+                path = PurePosixPath(info.filename)
+
+                if (
+                    info.is_dir()
+                    or path.suffix.lower() != ".gpx"
+                    or path.name.startswith(".")
+                    or "__MACOSX" in path.parts
+                ):
+                    continue
+
+                if info.file_size > settings.gpx_max_bytes:
+                    budget.take(0)
+                    items.append(BatchItem(path.name, error="GPX file is too large"))
+                    continue
+
+                # reading never gives back more than the size the entry
+                # claims, so this is charged before anything is inflated
+                budget.take(info.file_size)
+
+                try:
+                    items.append(BatchItem(path.name, data=archive.read(info)))
+                except NotImplementedError:
+                    items.append(
+                        BatchItem(path.name, error="Unsupported zip compression")
+                    )
+    except zipfile.BadZipFile:
+        return [BatchItem(filename, error="Invalid zip file")]
+
+    return items
+
+
+def collect_files(files: Iterable[Tuple[str, bytes]]) -> List[BatchItem]:
+    items = []
+    budget = BatchBudget()
+
+    for filename, data in files:
+        if filename.lower().endswith(".zip"):
+            items.extend(expand_archive(filename, data, budget))
+        else:
+            budget.take(len(data))
+            items.append(BatchItem(filename, data=data))
+
+    return items
+
+
+async def prepare_batch(
+    files: Iterable[Tuple[str, bytes]], workers: Optional[int] = None
+) -> List[BatchItem]:
+    from app.gpx import GPXError, prepare_gpx
+
+    items = collect_files(files)
+    pending = [item for item in items if item.error is None]
+
+    # spread over every worker, but never more at once than there are of
+    # them so a big batch doesn't fill the queue renders are turned away from
+    limit = asyncio.Semaphore(workers or settings.render_workers)
+
+    async def prepare(item: BatchItem):
+        async with limit:
+            return await run_in_pool(
+                prepare_gpx,
+                item.data,
+                settings.ingest_simplify_tolerance,
+                settings.heatmap_max_zoom,
+            )
+
+    results = await asyncio.gather(
+        *[prepare(item) for item in pending], return_exceptions=True
+    )
+
+    for item, result in zip(pending, results):
+        item.data = None
+
+        if isinstance(result, GPXError):
+            item.error = str(result)
+        elif isinstance(result, BaseException):
+            logger.opt(exception=result).error(f"Failed to prepare {item.filename}")
+            item.error = "Something went wrong"
+        else:
+            item.track = result
+
+    return items
+
+
+def unique_slug(slug: str, taken: Set[str]) -> str:
+    candidate = slug
+    suffix = 2
+
+    while candidate in taken:
+        candidate = f"{slug}-{suffix}"
+        suffix += 1
+
+    taken.add(candidate)
+
+    return candidate
+
+
+async def insert_batch(
+    con: Connection, user_id: int, items: List[BatchItem], check_quota: bool = True
+) -> List[BatchItem]:
+    async with con.transaction():
+        # locking the user serialises batches for them, so the quota and the
+        # slugs picked below can't race another import
+        existing = await con.fetchrow(
+            """
+            SELECT
+                ARRAY(SELECT slug FROM tracks WHERE user_id = users.id) AS slugs,
+                (
+                    SELECT COUNT(*) FROM ingest_jobs
+                    WHERE user_id = users.id AND status IN ('queued', 'running')
+                ) AS pending
+            FROM users
+            WHERE id = $1
+            FOR UPDATE
+            """,
+            user_id,
+        )
+
+        taken = set(existing["slugs"])
+        remaining = settings.max_tracks_per_user - len(taken) - existing["pending"]
+
+        accepted = []
+        tracks = []
+
+        for item in items:
+            if item.track is None:
+                continue
+
+            try:
+                name, activity = track_details(
+                    item.track.name, item.track.activity, item.filename
+                )
+            except IngestError as e:
+                item.error = str(e)
+                continue
+
+            if check_quota and remaining <= 0:
+                item.error = "You have reached the maximum number of tracks"
+                continue
+
+            remaining -= 1
+
+            # a batch never replaces tracks, repeated names get a numbered slug
+            item.slug = unique_slug(slugify_name(name), taken)
+
+            accepted.append(item)
+            tracks.append((name, item.slug, item.track.ewkb, activity, user_id))
+
+        if not accepted:
+            return items
+
+        await con.copy_records_to_table(
+            "tracks",
+            records=tracks,
+            columns=["name", "slug", "geometry", "activity", "user_id"],
+        )
+
+        await store_track_stats(
+            con,
+            user_id,
+            [
+                (
+                    item.slug,
+                    item.track.started_at,
+                    item.track.finished_at,
+                    item.track.elevation_gain,
+                )
+                for item in accepted
+            ],
+        )
+
+        hashes = await con.fetch(
+            """
+            SELECT slug, geometry_hash FROM tracks
+            WHERE user_id = $1 AND slug = ANY($2::text[])
+            """,
+            user_id,
+            [item.slug for item in accepted],
+        )
+        geometry_hashes = {record["slug"]: record["geometry_hash"] for record in hashes}
+
+        await con.copy_records_to_table(
+            "thumbnails",
+            records=[
+                (
+                    user_id,
+                    item.slug,
+                    geometry_hashes[item.slug],
+                    render_params(),
+                    item.track.png,
+                )
+                for item in accepted
+            ],
+            columns=["user_id", "slug", "geometry_hash", "params", "png"],
+        )
+
+        await update_heatmap(con, [item.track.heatmap for item in accepted])
+
+    bump_data_version(user_id)
+
+    logger.info(f"Inserted {len(accepted)} tracks for user {user_id}")
+
+    return items
@@ -0,0 +1,42 @@
+from collections import OrderedDict
+from typing import Optional, Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+
+class LRUCache(Generic[K]):
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict[K, bytes] = OrderedDict()
+
+    def get(self, key: K) -> Optional[bytes]:
+        value = self.entries.get(key)
+
+        if value is not None:
+            self.entries.move_to_end(key)
+
+        return value
+
+    def put(self, key: K, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+
+        self.entries[key] = value
+        self.size += len(value)
+
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def drop(self, predicate: Callable[[K], bool]):
+        for key in [key for key in self.entries if predicate(key)]:
+            self.size -= len(self.entries.pop(key))
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
@@ -0,0 +1,83 @@
+import asyncio
+import gzip
+import zlib
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# in order of preference, the first one a client accepts is used
+ENCODINGS = ["br", "gzip"]
+
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# streamed responses are compressed as they go, cheaply, since the cost is
+# paid again for every chunk of every request
+STREAM_LEVEL = 1
+
+
+def available_encodings() -> List[str]:
+    return [encoding for encoding in ENCODINGS if encoding != "br" or brotli]
+
+
+def compress(data: bytes, encoding: str, best: bool = False) -> bytes:
+    # best is for work done once ahead of time, responses built on demand
+    # use a level that costs about as much as serialising them did
+    match encoding:
+        case "br":
+            return brotli.compress(data, quality=11 if best else 5)
+        case "gzip":
+            return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+        case _:
+            raise ValueError(f"Unknown encoding {encoding}")
+
+
+def negotiate_encoding(
+    accept_encoding: Optional[str], available: List[str]
+) -> Optional[str]:
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        accepted[coding.strip().lower()] = quality
+
+    for encoding in available:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+
+    return None
+
+
+def compress_chunk(compressor, chunk: bytes) -> bytes:
+    # flushed so the client can use everything sent so far straight away
+    return compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    # wbits of 31 makes zlib write a gzip header and trailer
+    compressor = zlib.compressobj(STREAM_LEVEL, zlib.DEFLATED, 31)
+
+    # closed with this one, so a client going away gives back the connection
+    async with aclosing(chunks):
+        async for chunk in chunks:
+            # zlib lets go of the gil, so a thread keeps this off the event loop
+            yield await asyncio.to_thread(compress_chunk, compressor, chunk)
+
+    yield compressor.flush()
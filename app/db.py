@@ -1,22 +1,50 @@
-from typing import Optional, AsyncGenerator
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, AsyncGenerator, Dict
 from contextlib import asynccontextmanager
 
 import bcrypt
 import asyncpg
+from asyncpg import Record
 from loguru import logger
 
+from app.metrics import add_db_time, add_pool_wait
 from app.settings import settings
 
 pool: Optional[asyncpg.Pool] = None
+pool_stats_task: Optional[asyncio.Task] = None
+
+# requests currently waiting in get_connection_from_pool for a free connection
+waiters = 0
+
+# bcrypt is slow on purpose, keep it off the event loop and cap how many run
+# at once so a burst of logins queues up instead of eating every core
+auth_executor = ThreadPoolExecutor(
+    max_workers=settings.auth_workers, thread_name_prefix="auth"
+)
+auth_semaphore = asyncio.Semaphore(settings.auth_workers)
 
 
 async def create_pool() -> asyncpg.Pool:
-    global pool
+    global pool, pool_stats_task
 
     if pool is None:
-        pool = await asyncpg.create_pool(settings.pg_dsn)
+        pool = await asyncpg.create_pool(
+            settings.pg_dsn,
+            min_size=settings.pg_pool_min_size,
+            max_size=settings.pg_pool_max_size,
+            max_inactive_connection_lifetime=settings.pg_pool_max_inactive_lifetime,
+            statement_cache_size=settings.pg_statement_cache_size,
+            command_timeout=settings.pg_command_timeout,
+            init=init_connection,
+        )
         if pool is None:
             raise Exception("Failed to create pool")
+
+        if settings.pg_pool_stats_interval > 0:
+            pool_stats_task = asyncio.create_task(log_pool_stats())
+
         return pool
     else:
         logger.warning("Attempt to create pool when pool already exists")
@@ -24,12 +52,17 @@ async def create_pool() -> asyncpg.Pool:
 
 
 async def close_pool() -> None:
-    global pool
+    global pool, pool_stats_task
 
     if pool is None:
         raise Exception("Attempt to close pool with no pool")
     else:
+        if pool_stats_task is not None:
+            pool_stats_task.cancel()
+            pool_stats_task = None
+
         await pool.close()
+        pool = None
 
 
 async def get_pool() -> asyncpg.Pool:
@@ -41,24 +74,180 @@ async def get_pool() -> asyncpg.Pool:
         return pool
 
 
-async def get_connection_from_pool():
+def pool_stats() -> Dict[str, int]:
+    if pool is None:
+        raise Exception("Attempt to get pool stats with no pool")
+
+    size = pool.get_size()
+    idle = pool.get_idle_size()
+
+    return {
+        "size": size,
+        "max_size": pool.get_max_size(),
+        "in_use": size - idle,
+        "idle": idle,
+        "waiters": waiters,
+    }
+
+
+async def log_pool_stats():
+    while True:
+        await asyncio.sleep(settings.pg_pool_stats_interval)
+
+        stats = pool_stats()
+        logger.info(
+            f"Pool {stats['in_use']} in use, {stats['idle']} idle, "
+            f"{stats['waiters']} waiting, {stats['size']}/{stats['max_size']} open"
+        )
+
+
+class TimedConnection:
+    # stands in for the pooled connection handed to routes, adding the time
+    # spent in each query to the request's db time
+    TIMED = {
+        "execute",
+        "executemany",
+        "fetch",
+        "fetchrow",
+        "fetchval",
+        "copy_records_to_table",
+        "copy_to_table",
+        "copy_from_query",
+    }
+
+    def __init__(self, connection: asyncpg.Connection):
+        self.connection = connection
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.connection, name)
+
+        if name not in self.TIMED:
+            return attr
+
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+
+            try:
+                return await attr(*args, **kwargs)
+            finally:
+                add_db_time(time.perf_counter() - start)
+
+        return timed
+
+
+@asynccontextmanager
+async def acquire_connection() -> AsyncGenerator[TimedConnection, None]:
+    global waiters
+
     pool = await get_pool()
-    async with pool.acquire() as connection:
-        try:
-            yield connection
-        finally:
-            await connection.close()
+
+    waiters += 1
+    start = time.perf_counter()
+    try:
+        connection = await pool.acquire()
+    finally:
+        waiters -= 1
+        add_pool_wait(time.perf_counter() - start)
+
+    try:
+        yield TimedConnection(connection)
+    finally:
+        await pool.release(connection)
+
+
+async def get_connection_from_pool():
+    async with acquire_connection() as connection:
+        yield connection
 
 
 async def get_connection() -> asyncpg.Connection:
     logger.info("Getting connection to Postgres")
-    return await asyncpg.connect(settings.pg_dsn)
+    connection = await asyncpg.connect(settings.pg_dsn)
+    await init_connection(connection)
+    return connection
+
+
+async def init_connection(con: asyncpg.Connection):
+    # geometry goes over the wire as (e)wkb bytes rather than hex text, this
+    # is also what lets copy_records_to_table write geometry columns
+    await con.set_type_codec(
+        "geometry",
+        schema="public",
+        encoder=bytes,
+        decoder=bytes,
+        format="binary",
+    )
+
+
+# statements behind the busiest routes, each a single round trip. their text
+# never changes, so asyncpg prepares one the first time a connection runs it
+# and reuses it from the statement cache from then on
+FETCH_USER = """
+    SELECT id, username FROM users WHERE username = $1
+"""
+
+FETCH_TRACK_REF = """
+    SELECT tracks.user_id, tracks.geometry_hash
+    FROM tracks
+    JOIN users ON tracks.user_id = users.id
+    WHERE users.username = $1 AND tracks.slug = $2
+"""
+
+FETCH_TRACK_DETAILS = """
+    SELECT
+        tracks.user_id,
+        tracks.slug,
+        tracks.name,
+        tracks.activity,
+        tracks.geometry_hash,
+        users.username,
+        track_stats.distance,
+        track_stats.points,
+        track_stats.duration,
+        track_stats.elevation_gain,
+        track_stats.started_at
+    FROM tracks
+    JOIN users ON tracks.user_id = users.id
+    LEFT JOIN track_stats USING (user_id, slug)
+    WHERE users.username = $1 AND tracks.slug = $2
+"""
+
+# nothing is inserted once the user is out of quota, see track_quota_remaining
+# for why two of these racing can't both take the last slot
+INSERT_INGEST_JOB = """
+    INSERT INTO ingest_jobs (user_id, filename, gpx)
+    SELECT $1, $2, $3
+    WHERE track_quota_remaining($1, $4) > 0
+    RETURNING id, user_id, filename, status, slug, error
+"""
+
+
+async def fetch_user(con: asyncpg.Connection, username: str) -> Optional[Record]:
+    return await con.fetchrow(FETCH_USER, username)
+
+
+async def fetch_track_ref(
+    con: asyncpg.Connection, username: str, slug: str
+) -> Optional[Record]:
+    return await con.fetchrow(FETCH_TRACK_REF, username, slug)
+
+
+async def fetch_track_details(
+    con: asyncpg.Connection, username: str, slug: str
+) -> Optional[Record]:
+    return await con.fetchrow(FETCH_TRACK_DETAILS, username, slug)
+
+
+async def insert_ingest_job(
+    con: asyncpg.Connection, user_id: int, filename: str, gpx: bytes, quota: int
+) -> Optional[Record]:
+    return await con.fetchrow(INSERT_INGEST_JOB, user_id, filename, gpx, quota)
 
 
 async def create_user(
     con: asyncpg.Connection, username: str, email: str, password: str, role: str
 ):
-    hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+    hashed_password = await hash_password(password)
 
     user_id = await con.fetchval(
         """
@@ -78,5 +267,19 @@ async def create_user(
     return user_id
 
 
-def check_password(password: str, hashed_password: bytes) -> bool:
-    return bcrypt.checkpw(password.encode("utf-8"), hashed_password)
+async def run_auth(fn, *args):
+    async with auth_semaphore:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(auth_executor, fn, *args)
+
+
+async def hash_password(password: str) -> bytes:
+    return await run_auth(
+        bcrypt.hashpw,
+        password.encode("utf-8"),
+        bcrypt.gensalt(rounds=settings.bcrypt_rounds),
+    )
+
+
+async def check_password(password: str, hashed_password: bytes) -> bool:
+    return await run_auth(bcrypt.checkpw, password.encode("utf-8"), hashed_password)
@@ -0,0 +1,180 @@
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import shapely
+
+from app.rasterizer import SAMPLE_STEP, encode_png, sample_segments, track_segments
+
+TileKey = Tuple[int, int, int]
+
+# cells along each side of a heatmap tile, one per pixel of a 256px map tile
+TILE_CELLS = 256
+
+# mercator stops being defined at the poles, this is where web maps cut off
+MAX_LATITUDE = 85.0511287798
+
+# longer than this between two points is a gap in the recording or a bad
+# fix, not somewhere the track went. drawn it would count every cell along
+# the way, which for a jump to 0,0 or across the antimeridian is thousands
+# of tiles
+MAX_SEGMENT_METRES = 5_000
+
+# (cell index, change in count) for every cell of a tile a change touches
+DELTA_DTYPE = np.dtype([("cell", "<u4"), ("delta", "<i4")])
+
+# dark blue through to yellow, sampled by how busy a cell is
+RAMP = np.array(
+    [
+        [0, 0, 160],
+        [0, 140, 255],
+        [0, 220, 120],
+        [255, 220, 0],
+        [255, 60, 0],
+    ],
+    dtype=np.float32,
+)
+
+
+def mercator(coords: np.ndarray) -> np.ndarray:
+    # lon/lat to web mercator scaled to the unit square, y pointing down
+    lon = coords[:, 0]
+    lat = np.radians(np.clip(coords[:, 1], -MAX_LATITUDE, MAX_LATITUDE))
+
+    x = (lon + 180) / 360
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2
+
+    return np.clip(np.column_stack([x, y]), 0, np.nextafter(1, 0))
+
+
+def segment_metres(coords: np.ndarray) -> np.ndarray:
+    # equirectangular, close enough over a few kilometres
+    deltas = np.diff(coords, axis=0)
+    latitude = np.radians((coords[:-1, 1] + coords[1:, 1]) / 2)
+
+    return np.hypot(deltas[:, 0] * np.cos(latitude) * 111_320, deltas[:, 1] * 110_540)
+
+
+def track_cells(wkb: bytes, max_zoom: int) -> Dict[TileKey, np.ndarray]:
+    # every cell at every zoom the track passes through, once each no matter
+    # how many of its points land in it, so counts are in tracks rather than
+    # in how often a device happened to record
+    coords, connected = track_segments(shapely.from_wkb(wkb))
+
+    if len(coords) == 0:
+        return {}
+
+    connected &= segment_metres(coords) <= MAX_SEGMENT_METRES
+
+    pixels = mercator(coords) * (2**max_zoom * TILE_CELLS)
+    samples = np.floor(sample_segments(pixels, connected, SAMPLE_STEP)).astype(np.int64)
+    samples = np.unique(samples, axis=0)
+
+    cells = {}
+
+    for z in range(max_zoom, -1, -1):
+        # a coarser cell is touched wherever one of the cells inside it is
+        at_zoom = np.unique(samples >> (max_zoom - z), axis=0)
+
+        tiles = at_zoom // TILE_CELLS
+        index = (at_zoom[:, 1] % TILE_CELLS) * TILE_CELLS + at_zoom[:, 0] % TILE_CELLS
+
+        order = np.lexsort((tiles[:, 1], tiles[:, 0]))
+        tiles, index = tiles[order], index[order]
+
+        starts = np.flatnonzero(np.any(np.diff(tiles, axis=0, prepend=-1), axis=1))
+
+        for tile, part in zip(tiles[starts], np.split(index, starts[1:])):
+            cells[(z, int(tile[0]), int(tile[1]))] = part
+
+    return cells
+
+
+def heatmap_deltas(
+    added: List[bytes], removed: List[bytes], max_zoom: int
+) -> Dict[TileKey, bytes]:
+    changes: Dict[TileKey, List[Tuple[np.ndarray, int]]] = {}
+
+    for wkbs, sign in ((added, 1), (removed, -1)):
+        for wkb in wkbs:
+            for key, cells in track_cells(wkb, max_zoom).items():
+                changes.setdefault(key, []).append((cells, sign))
+
+    deltas = {}
+
+    for key, parts in changes.items():
+        cells = np.concatenate([cells for cells, _ in parts])
+        signs = np.concatenate([np.full(len(cells), sign) for cells, sign in parts])
+
+        cells, inverse = np.unique(cells, return_inverse=True)
+        sums = np.bincount(inverse, weights=signs).astype(np.int32)
+
+        # a track replaced by itself cancels out
+        nonzero = sums != 0
+
+        if not nonzero.any():
+            continue
+
+        delta = np.empty(nonzero.sum(), dtype=DELTA_DTYPE)
+        delta["cell"] = cells[nonzero]
+        delta["delta"] = sums[nonzero]
+
+        # plain bytes back to the caller, which never imports numpy
+        deltas[key] = delta.tobytes()
+
+    return deltas
+
+
+def decode_counts(counts: Optional[bytes]) -> np.ndarray:
+    if counts is None:
+        return np.zeros(TILE_CELLS * TILE_CELLS, dtype=np.uint16)
+
+    return np.frombuffer(zlib.decompress(counts), dtype="<u2")
+
+
+def apply_heatmap_deltas(
+    tiles: Dict[TileKey, Optional[bytes]], deltas: List[Dict[TileKey, bytes]]
+) -> Dict[TileKey, Optional[bytes]]:
+    # deltas has one entry per track, only tiles whose counts end up
+    # different are returned, None for those that have emptied out
+    changes: Dict[TileKey, List[np.ndarray]] = {}
+
+    for track in deltas:
+        for key, delta in track.items():
+            changes.setdefault(key, []).append(np.frombuffer(delta, dtype=DELTA_DTYPE))
+
+    updated = {}
+
+    for key, parts in changes.items():
+        counts = decode_counts(tiles.get(key))
+        grid = counts.astype(np.int32)
+
+        for delta in parts:
+            grid[delta["cell"]] += delta["delta"]
+
+        # saturates rather than wrapping on the busiest cells
+        grid = np.clip(grid, 0, np.iinfo(np.uint16).max).astype("<u2")
+
+        if np.array_equal(grid, counts):
+            continue
+
+        updated[key] = zlib.compress(grid.tobytes(), 6) if grid.any() else None
+
+    return updated
+
+
+def render_heatmap_png(counts: Optional[bytes], saturation: int) -> bytes:
+    grid = decode_counts(counts).reshape(TILE_CELLS, TILE_CELLS)
+
+    # log scaled so one track still shows up next to a popular route
+    intensity = np.clip(np.log1p(grid) / np.log1p(saturation), 0, 1)
+
+    position = intensity * (len(RAMP) - 1)
+    lower = np.minimum(position.astype(np.int64), len(RAMP) - 2)
+    fraction = (position - lower)[:, :, None]
+
+    rgba = np.zeros((TILE_CELLS, TILE_CELLS, 4), dtype=np.uint8)
+    rgba[:, :, :3] = np.rint(RAMP[lower] * (1 - fraction) + RAMP[lower + 1] * fraction)
+    rgba[:, :, 3] = np.where(grid > 0, np.rint(96 + 159 * intensity), 0)
+
+    return encode_png(rgba)
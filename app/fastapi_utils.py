@@ -1,8 +1,12 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urlencode
 
 from fastapi import Request
 from fastapi.templating import Jinja2Templates
 
+from app.static_files import static_url
+from app.stats import format_distance, format_duration, format_elevation
+
 
 def user_context(request: Request) -> Dict[str, Any]:
     return {
@@ -11,6 +15,10 @@ def user_context(request: Request) -> Dict[str, Any]:
 
 
 templates = Jinja2Templates(directory="templates", context_processors=[user_context])
+templates.env.filters["distance"] = format_distance
+templates.env.filters["duration"] = format_duration
+templates.env.filters["elevation"] = format_elevation
+templates.env.globals["static_url"] = static_url
 
 
 def activity_to_emoji(activity: str):
@@ -29,6 +37,46 @@ def setup_user_session(request: Request, id: int, username: str, role: str):
     }
 
 
+def url_with(request: Request, **params: Optional[str]) -> str:
+    # the current page's path and query with some params swapped, None drops one
+    query = {**request.query_params, **params}
+    query = {key: value for key, value in query.items() if value is not None}
+
+    return f"{request.url.path}?{urlencode(query)}"
+
+
+templates.env.globals["url_with"] = url_with
+
+
+def wants_fragment(request: Request) -> bool:
+    # htmx asking for a piece of a page, boosted navigation wants the whole page
+    return "hx-request" in request.headers and "hx-boosted" not in request.headers
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+
+    if if_none_match is None:
+        return False
+
+    return any(
+        candidate.strip() in (etag, f"W/{etag}", "*")
+        for candidate in if_none_match.split(",")
+    )
+
+
+def parse_bbox(bbox: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+    if bbox is None:
+        return None
+
+    minx, miny, maxx, maxy = (float(value) for value in bbox.split(","))
+
+    if minx > maxx or miny > maxy:
+        raise ValueError(f"Invalid bbox {bbox}")
+
+    return (minx, miny, maxx, maxy)
+
+
 # TODO make this the page when a route throws a 404
 def not_found_resp(request: Request):
     return templates.TemplateResponse(
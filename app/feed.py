@@ -0,0 +1,298 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Optional, Tuple, Dict, AsyncIterator
+
+from asyncpg import Connection, Record
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from app.cache import LRUCache
+from app.compression import (
+    available_encodings,
+    compress,
+    gzip_stream,
+    negotiate_encoding,
+)
+from app.db import acquire_connection, fetch_user, get_pool
+from app.lod import (
+    lod_tier,
+    lod_column,
+    lod_polyline_column,
+    lod_decimals,
+    lod_info,
+)
+from app.settings import settings
+from app.versions import data_version
+
+BBox = Tuple[float, float, float, float]
+
+# rows fetched per cursor round trip, and how much ndjson to buffer per write
+CURSOR_PREFETCH = 200
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# user id (None for everyone) -> (data version, aggregates)
+aggregates_cache: Dict[Optional[int], Tuple[int, Record]] = {}
+
+
+@dataclass
+class CachedFeed:
+    # whose data version the feed was built from, None for everyone's
+    user_id: Optional[int]
+    version: int
+    body: bytes
+
+    def __len__(self) -> int:
+        return len(self.body)
+
+
+# (username, lod tier, content encoding) -> feed, keyed on the username so a
+# hit doesn't need the user looked up first. a bbox is the map's viewport
+# and differs on nearly every pan, so only whole feeds are kept
+json_cache: LRUCache[tuple] = LRUCache(settings.feed_cache_max_bytes)
+
+
+def track_filters(user_id: Optional[int], bbox: Optional[BBox]):
+    conditions = []
+    args = []
+
+    if user_id is not None:
+        args.append(user_id)
+        conditions.append(f"tracks.user_id = ${len(args)}")
+
+    if bbox is not None:
+        args.extend(bbox)
+        conditions.append(
+            f"tracks.geometry && ST_MakeEnvelope(${len(args) - 3}, ${len(args) - 2}, "
+            f"${len(args) - 1}, ${len(args)}, 4326)"
+        )
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    return where, args
+
+
+async def fetch_aggregates(con: Connection, user_id: Optional[int] = None):
+    version = data_version(user_id)
+    cached = aggregates_cache.get(user_id)
+
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    where, args = track_filters(user_id, None)
+
+    aggregates = await con.fetchrow(
+        f"""
+        SELECT
+            ST_AsGeoJSON(ST_Centroid(ST_Extent(geometry)))::json as center,
+            ST_AsGeoJSON(ST_Extent(geometry))::json as extent
+        FROM
+            tracks
+        {where}
+    """,
+        *args,
+    )
+
+    aggregates_cache[user_id] = (version, aggregates)
+
+    return aggregates
+
+
+async def fetch_tracks(
+    con: Connection,
+    tier: int,
+    user_id: Optional[int] = None,
+    bbox: Optional[BBox] = None,
+):
+    where, args = track_filters(user_id, bbox)
+
+    return await con.fetch(
+        f"""
+        SELECT
+            slug,
+            name,
+            activity,
+            username,
+            ST_AsGeoJSON({lod_column(tier)}, {lod_decimals(tier)})::json as geometry
+        FROM
+            tracks
+        JOIN
+            users ON tracks.user_id = users.id
+        {where}
+    """,
+        *args,
+    )
+
+
+async def json_data(
+    con: Connection,
+    zoom: Optional[float],
+    bbox: Optional[BBox] = None,
+    user_id: Optional[int] = None,
+):
+    tier = lod_tier(zoom)
+
+    return {
+        "aggregates": await fetch_aggregates(con, user_id),
+        "lod": lod_info(tier),
+        "tracks": await fetch_tracks(con, tier, user_id, bbox),
+    }
+
+
+async def build_feed(
+    zoom: Optional[float],
+    bbox: Optional[BBox],
+    username: Optional[str],
+    encoding: Optional[str],
+) -> Optional[CachedFeed]:
+    # see render_page in app.page_cache for why the global version is read
+    # before the queries
+    since = data_version()
+
+    async with acquire_connection() as con:
+        user_id = None
+
+        if username is not None:
+            user = await fetch_user(con, username)
+
+            if user is None:
+                return None
+
+            user_id = user["id"]
+
+        data = await json_data(con, zoom, bbox, user_id)
+
+    version = min(data_version(user_id), since)
+
+    # serialised the same way fastapi would have returned the dict
+    body = JSONResponse(jsonable_encoder(data)).body
+
+    if encoding is not None:
+        # both compressors let go of the gil, so a thread keeps this off the
+        # event loop without copying the body to another process
+        body = await asyncio.to_thread(compress, body, encoding)
+
+    return CachedFeed(user_id=user_id, version=version, body=body)
+
+
+async def json_response(
+    request: Request,
+    zoom: Optional[float],
+    bbox: Optional[BBox] = None,
+    username: Optional[str] = None,
+) -> Optional[Response]:
+    # None when there's no such user. only takes a connection on a miss
+    encoding = negotiate_encoding(
+        request.headers.get("accept-encoding"), available_encodings()
+    )
+    key = (username, lod_tier(zoom), encoding)
+
+    feed = json_cache.get(key) if bbox is None else None
+
+    if feed is None or feed.version != data_version(feed.user_id):
+        feed = await build_feed(zoom, bbox, username, encoding)
+
+        if feed is None:
+            return None
+
+        if bbox is None:
+            json_cache.put(key, feed)
+
+    headers = {"Vary": "Accept-Encoding"}
+
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+
+    return Response(feed.body, media_type="application/json", headers=headers)
+
+
+def feature_geometry(tier: int, encoding: str) -> str:
+    match encoding:
+        case "geojson":
+            return f"""
+                'geometry', ST_AsGeoJSON(
+                    {lod_column(tier)}, {lod_decimals(tier)}
+                )::json
+            """
+        case "polyline":
+            return f"'polylines', {lod_polyline_column(tier)}"
+        case _:
+            raise ValueError(f"Unknown encoding {encoding}")
+
+
+async def stream_tracks(
+    tier: int,
+    user_id: Optional[int] = None,
+    bbox: Optional[BBox] = None,
+    encoding: str = "geojson",
+) -> AsyncIterator[bytes]:
+    where, args = track_filters(user_id, bbox)
+
+    # this outlives the request's dependencies, so it takes its own connection
+    pool = await get_pool()
+
+    async with pool.acquire() as con:
+        async with con.transaction():
+            chunk = []
+            chunk_size = 0
+
+            async for record in con.cursor(
+                f"""
+                SELECT
+                    json_build_object(
+                        'type', 'Feature',
+                        'properties', json_build_object(
+                            'slug', slug,
+                            'name', name,
+                            'activity', activity,
+                            'username', username
+                        ),
+                        {feature_geometry(tier, encoding)}
+                    )::text AS feature
+                FROM
+                    tracks
+                JOIN
+                    users ON tracks.user_id = users.id
+                {where}
+                """,
+                *args,
+                prefetch=CURSOR_PREFETCH,
+            ):
+                line = record["feature"].encode("utf-8") + b"\n"
+                chunk.append(line)
+                chunk_size += len(line)
+
+                if chunk_size >= STREAM_CHUNK_BYTES:
+                    yield b"".join(chunk)
+                    chunk = []
+                    chunk_size = 0
+
+            if chunk:
+                yield b"".join(chunk)
+
+
+def ndjson_response(
+    request: Request,
+    zoom: Optional[float],
+    bbox: Optional[BBox] = None,
+    user_id: Optional[int] = None,
+    encoding: str = "geojson",
+) -> StreamingResponse:
+    tier = lod_tier(zoom)
+    lod = lod_info(tier)
+
+    body = stream_tracks(tier, user_id, bbox, encoding)
+    headers = {
+        "X-Lod-Tier": str(lod["tier"]),
+        "X-Lod-Min-Zoom": str(lod["min_zoom"]),
+        "X-Lod-Max-Zoom": str(lod["max_zoom"]),
+        "X-Polyline-Precision": str(lod_decimals(tier)),
+        "Vary": "Accept-Encoding",
+    }
+
+    # only gzip, brotli would need a streaming encoder of its own
+    if negotiate_encoding(request.headers.get("accept-encoding"), ["gzip"]):
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
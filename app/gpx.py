@@ -0,0 +1,287 @@
+import io
+import struct
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional, BinaryIO, Dict, List, Tuple
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from app.settings import settings
+
+INITIAL_CAPACITY = 4096
+
+WKB_LITTLE_ENDIAN = 1
+WKB_LINESTRING = 2
+WKB_MULTILINESTRING = 5
+
+
+class GPXError(Exception):
+    pass
+
+
+@dataclass
+class ParsedTrack:
+    name: Optional[str]
+    activity: Optional[str]
+    # (n, 2) lon/lat
+    coords: np.ndarray
+    # start index of each trkseg in coords
+    part_offsets: np.ndarray
+    # NaN where a trkpt has no <ele> / <time>, times are unix seconds
+    elevations: np.ndarray
+    times: np.ndarray
+
+    def parts(self) -> List[slice]:
+        ends = np.append(self.part_offsets[1:], len(self.coords))
+        return [slice(start, end) for start, end in zip(self.part_offsets, ends)]
+
+    def to_wkb(self) -> bytes:
+        parts = self.parts()
+        chunks = [
+            struct.pack("<BII", WKB_LITTLE_ENDIAN, WKB_MULTILINESTRING, len(parts))
+        ]
+
+        for part in parts:
+            coords = self.coords[part]
+            chunks.append(
+                struct.pack("<BII", WKB_LITTLE_ENDIAN, WKB_LINESTRING, len(coords))
+            )
+            chunks.append(coords.astype("<f8").tobytes())
+
+        return b"".join(chunks)
+
+    def time_span(self) -> Tuple[Optional[datetime], Optional[datetime]]:
+        if np.isnan(self.times).all():
+            return None, None
+
+        # stored as naive utc, like every other timestamp in the db
+        return tuple(
+            datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+            for seconds in (np.nanmin(self.times), np.nanmax(self.times))
+        )
+
+    def elevation_gain(self) -> Optional[float]:
+        if np.isnan(self.elevations).all():
+            return None
+
+        # climbs don't carry over from the end of one trkseg to the next
+        deltas = np.diff(self.elevations)
+        deltas[self.part_offsets[1:] - 1] = np.nan
+
+        return float(np.nansum(np.maximum(deltas, 0)))
+
+
+@dataclass
+class PreparedTrack:
+    name: Optional[str]
+    activity: Optional[str]
+    # with the srid set, ready to be sent as a geometry parameter
+    ewkb: bytes
+    points: int
+    png: bytes
+    # what adding the track does to the heatmap, see app.density
+    heatmap: Dict[Tuple[int, int, int], bytes]
+    # worked out from the full gpx, before simplifying
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+    elevation_gain: Optional[float]
+
+
+class PointBuffer:
+    def __init__(self, max_points: int):
+        self.max_points = max_points
+        self.size = 0
+
+        capacity = min(INITIAL_CAPACITY, max_points)
+        self.coords = np.empty((capacity, 2), dtype=np.float64)
+        self.elevations = np.empty(capacity, dtype=np.float64)
+        self.times = np.empty(capacity, dtype=np.float64)
+
+    def grow(self):
+        capacity = min(len(self.coords) * 2, self.max_points)
+
+        if capacity <= len(self.coords):
+            raise GPXError(f"Track has more than {self.max_points} points")
+
+        self.coords = np.resize(self.coords, (capacity, 2))
+        self.elevations = np.resize(self.elevations, capacity)
+        self.times = np.resize(self.times, capacity)
+
+    def append(self, lon: float, lat: float, elevation: float, time: float):
+        if self.size == len(self.coords):
+            self.grow()
+
+        self.coords[self.size] = (lon, lat)
+        self.elevations[self.size] = elevation
+        self.times[self.size] = time
+        self.size += 1
+
+
+class LimitedReader:
+    def __init__(self, file: BinaryIO, max_bytes: int):
+        self.file = file
+        self.remaining = max_bytes
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        self.remaining -= len(data)
+
+        if self.remaining < 0:
+            raise GPXError("GPX file is too large")
+
+        return data
+
+
+def local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_time(text: Optional[str]) -> float:
+    if not text:
+        return np.nan
+
+    try:
+        return datetime.fromisoformat(text.strip()).timestamp()
+    except ValueError:
+        return np.nan
+
+
+def parse_float(text: Optional[str]) -> float:
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def parse_gpx(
+    file: BinaryIO,
+    max_points: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+) -> ParsedTrack:
+    max_points = max_points or settings.gpx_max_points
+    max_bytes = max_bytes or settings.gpx_max_bytes
+
+    points = PointBuffer(max_points)
+    part_offsets = []
+
+    name = None
+    activity = None
+
+    # only the first <trk> is used, same as the upload always did
+    track = None
+    segment = None
+
+    # tags come back namespaced, strip them once per distinct tag not per event
+    names = {}
+
+    try:
+        for event, elem in ET.iterparse(
+            LimitedReader(file, max_bytes), events=("start", "end")
+        ):
+            tag = names.get(elem.tag)
+
+            if tag is None:
+                tag = names[elem.tag] = local_name(elem.tag)
+
+            if event == "start":
+                if tag == "trk":
+                    track = elem
+                elif tag == "trkseg" and track is not None:
+                    segment = elem
+                    part_offsets.append(points.size)
+
+                continue
+
+            if tag == "trkpt" and segment is not None:
+                elevation = np.nan
+                time = np.nan
+
+                for child in elem:
+                    match names.get(child.tag):
+                        case "ele":
+                            elevation = parse_float(child.text)
+                        case "time":
+                            time = parse_time(child.text)
+
+                points.append(
+                    parse_float(elem.get("lon")),
+                    parse_float(elem.get("lat")),
+                    elevation,
+                    time,
+                )
+
+                # drop the point from the tree so memory stays flat
+                segment.remove(elem)
+            elif tag == "trkseg":
+                segment = None
+            elif tag == "trk":
+                for child in elem:
+                    match names.get(child.tag):
+                        case "name":
+                            name = name or (child.text or "").strip() or None
+                        case "type":
+                            activity = activity or (child.text or "").strip() or None
+
+                break
+            elif tag in ("wpt", "rte"):
+                elem.clear()
+    except ET.ParseError as e:
+        raise GPXError(f"Invalid GPX file: {e}") from e
+
+    coords = points.coords[: points.size]
+
+    if np.isnan(coords).any():
+        raise GPXError("Track has points without a valid lat/lon")
+
+    # a linestring needs at least two points, drop segments that don't
+    starts = np.array(part_offsets, dtype=np.int64)
+    ends = np.append(starts[1:], points.size)
+    keep = (ends - starts) >= 2
+
+    if not keep.any():
+        raise GPXError("No track found in GPX file")
+
+    mask = np.zeros(points.size, dtype=bool)
+    for start, end in zip(starts[keep], ends[keep]):
+        mask[start:end] = True
+
+    lengths = (ends - starts)[keep]
+
+    return ParsedTrack(
+        name=name,
+        activity=activity,
+        coords=coords[mask],
+        part_offsets=np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64),
+        elevations=points.elevations[: points.size][mask],
+        times=points.times[: points.size][mask],
+    )
+
+
+def prepare_gpx(data: bytes, tolerance: float, heatmap_max_zoom: int) -> PreparedTrack:
+    # runs in a render pool worker, everything an upload needs before it can
+    # be inserted is done here so the event loop only does the db work
+    import shapely
+
+    from app.density import heatmap_deltas
+    from app.rasterizer import render_track_png
+
+    track = parse_gpx(io.BytesIO(data))
+
+    geometry = shapely.simplify(
+        shapely.from_wkb(track.to_wkb()), tolerance, preserve_topology=True
+    )
+    ewkb = shapely.to_wkb(shapely.set_srid(geometry, 4326), include_srid=True)
+    started_at, finished_at = track.time_span()
+
+    return PreparedTrack(
+        name=track.name,
+        activity=track.activity,
+        ewkb=ewkb,
+        points=shapely.get_num_coordinates(geometry),
+        png=render_track_png(ewkb),
+        heatmap=heatmap_deltas([ewkb], [], heatmap_max_zoom),
+        started_at=started_at,
+        finished_at=finished_at,
+        elevation_gain=track.elevation_gain(),
+    )
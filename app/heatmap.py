@@ -0,0 +1,165 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from asyncpg import Connection
+
+from app.cache import LRUCache
+from app.render_pool import run_in_pool
+from app.settings import settings
+from app.tiles import TileKey
+
+# what adding or removing tracks does to each tile, see app.density
+HeatmapDeltas = Dict[TileKey, bytes]
+
+# keyed on the tile and its version, which every write to it moves on, so
+# entries never need clearing whichever process or machine made the write
+heatmap_cache: LRUCache[Tuple[int, int, int, Optional[int]]] = LRUCache(
+    settings.heatmap_cache_max_bytes
+)
+
+
+async def track_deltas(added: List[bytes], removed: List[bytes]) -> HeatmapDeltas:
+    # binning a track is the slow part, so it's done before the transaction
+    # that applies it rather than while that holds its locks
+    from app.density import heatmap_deltas
+
+    return await run_in_pool(heatmap_deltas, added, removed, settings.heatmap_max_zoom)
+
+
+async def update_heatmap(con: Connection, deltas: List[HeatmapDeltas]):
+    # applies the deltas of each track added or removed, touching only the
+    # tiles they pass through. meant to run in the same transaction as the
+    # write to tracks, so the counts never drift from it
+    from app.density import apply_heatmap_deltas
+
+    keys = sorted(set().union(*deltas))
+
+    if not keys:
+        return
+
+    zs, xs, ys = (list(column) for column in zip(*keys))
+
+    # every touched tile needs a row before it can be locked, and they're
+    # locked in key order so two updates sharing tiles can't deadlock
+    await con.execute(
+        """
+        INSERT INTO heatmap_tiles (z, x, y)
+        SELECT * FROM unnest($1::smallint[], $2::integer[], $3::integer[])
+        ON CONFLICT DO NOTHING
+        """,
+        zs,
+        xs,
+        ys,
+    )
+
+    records = await con.fetch(
+        """
+        SELECT heatmap_tiles.z, heatmap_tiles.x, heatmap_tiles.y, counts
+        FROM heatmap_tiles
+        JOIN unnest($1::smallint[], $2::integer[], $3::integer[]) AS touched (z, x, y)
+            USING (z, x, y)
+        ORDER BY z, x, y
+        FOR UPDATE OF heatmap_tiles
+        """,
+        zs,
+        xs,
+        ys,
+    )
+
+    tiles = {
+        (record["z"], record["x"], record["y"]): record["counts"] for record in records
+    }
+
+    updated = await run_in_pool(apply_heatmap_deltas, tiles, deltas)
+
+    changed = [key for key in keys if updated.get(key) is not None]
+    # tiles nothing passes through any more
+    emptied = [key for key in keys if key in updated and updated[key] is None]
+
+    if changed:
+        await con.execute(
+            """
+            UPDATE heatmap_tiles SET
+                counts = updated.counts,
+                version = nextval('heatmap_tile_versions')
+            FROM unnest($1::smallint[], $2::integer[], $3::integer[], $4::bytea[])
+                AS updated (z, x, y, counts)
+            WHERE heatmap_tiles.z = updated.z
+                AND heatmap_tiles.x = updated.x
+                AND heatmap_tiles.y = updated.y
+            """,
+            *(list(column) for column in zip(*changed)),
+            [updated[key] for key in changed],
+        )
+
+    if emptied:
+        await con.execute(
+            """
+            DELETE FROM heatmap_tiles
+            USING unnest($1::smallint[], $2::integer[], $3::integer[])
+                AS emptied (z, x, y)
+            WHERE heatmap_tiles.z = emptied.z
+                AND heatmap_tiles.x = emptied.x
+                AND heatmap_tiles.y = emptied.y
+            """,
+            *(list(column) for column in zip(*emptied)),
+        )
+
+
+async def fetch_heatmap_version(
+    con: Connection, z: int, x: int, y: int
+) -> Optional[int]:
+    # None for a tile nothing passes through
+    return await con.fetchval(
+        "SELECT version FROM heatmap_tiles WHERE z = $1 AND x = $2 AND y = $3",
+        z,
+        x,
+        y,
+    )
+
+
+async def fetch_heatmap_counts(
+    con: Connection, z: int, x: int, y: int
+) -> Tuple[Optional[int], Optional[bytes]]:
+    # the version comes from the same row as the counts, so a write landing
+    # after fetch_heatmap_version can't get them cached under the old one
+    record = await con.fetchrow(
+        "SELECT version, counts FROM heatmap_tiles WHERE z = $1 AND x = $2 AND y = $3",
+        z,
+        x,
+        y,
+    )
+
+    if record is None:
+        return None, None
+
+    return record["version"], record["counts"]
+
+
+async def rebuild_heatmap(con: Connection, batch_size: int = 100) -> int:
+    # from scratch, for tracks written before the heatmap existed. the lock
+    # makes ingests wait until it's done rather than land half counted
+    async with con.transaction():
+        await con.execute("LOCK TABLE heatmap_tiles IN EXCLUSIVE MODE")
+        await con.execute("DELETE FROM heatmap_tiles")
+
+        total = 0
+        batch = []
+
+        async def count(batch: List[bytes]):
+            deltas = await asyncio.gather(*[track_deltas([wkb], []) for wkb in batch])
+            await update_heatmap(con, list(deltas))
+
+        async for record in con.cursor("SELECT geometry FROM tracks"):
+            batch.append(record["geometry"])
+
+            if len(batch) >= batch_size:
+                await count(batch)
+                total += len(batch)
+                batch = []
+
+        if batch:
+            await count(batch)
+            total += len(batch)
+
+    return total
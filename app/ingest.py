@@ -0,0 +1,344 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+from asyncpg import Connection, Record
+from loguru import logger
+
+from app.db import get_pool, insert_ingest_job
+from app.heatmap import track_deltas, update_heatmap
+from app.render_pool import run_in_pool
+from app.settings import settings
+from app.stats import store_track_stats
+from app.thumbnails import invalidate_thumbnails, store_thumbnail, thumbnail_key
+from app.versions import bump_data_version
+
+workers: List[asyncio.Task] = []
+
+# set when a job is queued from this process, so an idle worker doesn't
+# have to wait for the next poll to pick it up
+wakeup = asyncio.Event()
+
+
+class IngestError(Exception):
+    pass
+
+
+def slugify_name(name: str):
+    name = name.encode("ascii", "ignore").decode("utf-8")
+    name = name.lower()
+    name = " ".join(name.split())
+    name = name.replace(" ", "-")
+    return name
+
+
+def track_details(
+    name: Optional[str], activity: Optional[str], filename: str
+) -> Tuple[str, str]:
+    name = name or filename
+
+    if name.lower().endswith(".gpx"):
+        name = name[:-4]
+
+    activity = activity or "walking"
+
+    errors = []
+
+    if len(name) < 3 or len(name) > 100:
+        errors.append("Name must be between 3 and 100 characters")
+
+    if len(activity) > 20:
+        errors.append("Activity must be at most 20 characters")
+
+    if len(errors) > 0:
+        raise IngestError(", ".join(errors))
+
+    return name, activity
+
+
+async def enqueue_ingest_job(
+    con: Connection, user_id: int, filename: str, gpx: bytes
+) -> Optional[Record]:
+    # None when the user has no tracks left, queued jobs count against that
+    # too, otherwise a burst of uploads skips the limit
+    job = await insert_ingest_job(
+        con, user_id, filename, gpx, settings.max_tracks_per_user
+    )
+
+    if job is not None:
+        wakeup.set()
+
+    return job
+
+
+async def fetch_ingest_job(con: Connection, job_id: int) -> Optional[Record]:
+    return await con.fetchrow(
+        """
+        SELECT id, user_id, filename, status, slug, error
+        FROM ingest_jobs
+        WHERE id = $1
+        """,
+        job_id,
+    )
+
+
+async def claim_job(con: Connection) -> Optional[Record]:
+    # SKIP LOCKED lets any number of workers, in any number of processes,
+    # poll the same table without handing out a job twice
+    return await con.fetchrow(
+        """
+        UPDATE ingest_jobs SET
+            status = 'running',
+            attempts = attempts + 1,
+            started_at = NOW()
+        WHERE id = (
+            SELECT id FROM ingest_jobs
+            WHERE status = 'queued'
+                OR (status = 'running' AND started_at < NOW() - make_interval(secs => $1))
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, user_id, filename, gpx, attempts
+        """,
+        settings.ingest_job_timeout,
+    )
+
+
+async def finish_job(
+    con: Connection,
+    job_id: int,
+    status: str,
+    slug: Optional[str] = None,
+    error: Optional[str] = None,
+):
+    await con.execute(
+        """
+        UPDATE ingest_jobs SET
+            status = $2,
+            slug = $3,
+            error = $4,
+            gpx = NULL,
+            finished_at = NOW()
+        WHERE id = $1
+        """,
+        job_id,
+        status,
+        slug,
+        error,
+    )
+
+
+async def fetch_track_geometry(
+    con: Connection, user_id: int, slug: str
+) -> Optional[Record]:
+    return await con.fetchrow(
+        """
+        SELECT geometry, geometry_hash FROM tracks
+        WHERE user_id = $1 AND slug = $2
+        """,
+        user_id,
+        slug,
+    )
+
+
+async def lock_track(con: Connection, user_id: int, slug: str) -> Optional[str]:
+    # locking the user serialises writes to their tracks. returns the hash
+    # of the track as it is now, None when there isn't one
+    return await con.fetchval(
+        """
+        SELECT tracks.geometry_hash
+        FROM users
+        LEFT JOIN tracks ON tracks.user_id = users.id AND tracks.slug = $2
+        WHERE users.id = $1
+        FOR UPDATE OF users
+        """,
+        user_id,
+        slug,
+    )
+
+
+async def ingest_track(job: Record) -> str:
+    from app.gpx import GPXError, prepare_gpx
+
+    try:
+        prepared = await run_in_pool(
+            prepare_gpx,
+            job["gpx"],
+            settings.ingest_simplify_tolerance,
+            settings.heatmap_max_zoom,
+        )
+    except GPXError as e:
+        raise IngestError(str(e)) from e
+
+    name, activity = track_details(prepared.name, prepared.activity, job["filename"])
+    user_id = job["user_id"]
+    slug = slugify_name(name)
+
+    pool = await get_pool()
+
+    async with pool.acquire() as con:
+        while True:
+            old = await fetch_track_geometry(con, user_id, slug)
+
+            # the track this replaces comes off the heatmap, worked out here
+            # so the transaction isn't holding its locks while that runs
+            deltas = [prepared.heatmap]
+            old_hash = None
+
+            if old is not None:
+                deltas.append(await track_deltas([], [old["geometry"]]))
+                old_hash = old["geometry_hash"]
+
+            async with con.transaction():
+                # replaced or deleted since it was read, what was worked out
+                # to take off is wrong so go round again
+                if await lock_track(con, user_id, slug) != old_hash:
+                    continue
+
+                geometry_hash = await con.fetchval(
+                    """
+                    INSERT INTO tracks (name, slug, geometry, activity, user_id)
+                    VALUES ($1, $2, $3, $4, $5)
+                    ON CONFLICT (user_id, slug) DO UPDATE SET
+                        name = EXCLUDED.name,
+                        geometry = EXCLUDED.geometry,
+                        activity = EXCLUDED.activity,
+                        updated_at = NOW()
+                    RETURNING geometry_hash
+                    """,
+                    name,
+                    slug,
+                    prepared.ewkb,
+                    activity,
+                    user_id,
+                )
+
+                await store_track_stats(
+                    con,
+                    user_id,
+                    [
+                        (
+                            slug,
+                            prepared.started_at,
+                            prepared.finished_at,
+                            prepared.elevation_gain,
+                        )
+                    ],
+                )
+
+                await update_heatmap(con, deltas)
+
+            break
+
+        bump_data_version(user_id)
+        await invalidate_thumbnails(con, user_id, slug)
+
+        # the thumbnail was drawn alongside the parse, so the first view of
+        # the track doesn't have to wait on a render
+        await store_thumbnail(
+            con, thumbnail_key(user_id, slug, geometry_hash), prepared.png
+        )
+
+    logger.info(f"Inserted track {name} ({prepared.points} points)")
+
+    return slug
+
+
+async def delete_track(con: Connection, user_id: int, slug: str):
+    while True:
+        old = await fetch_track_geometry(con, user_id, slug)
+
+        if old is None:
+            return
+
+        deltas = await track_deltas([], [old["geometry"]])
+
+        async with con.transaction():
+            # the same dance as ingest_track, so a replace landing in between
+            # can't leave the heatmap taking the wrong track off
+            if await lock_track(con, user_id, slug) != old["geometry_hash"]:
+                continue
+
+            await con.execute(
+                """
+                DELETE FROM tracks
+                WHERE slug = $1 AND user_id = $2
+                """,
+                slug,
+                user_id,
+            )
+
+            await update_heatmap(con, [deltas])
+
+        break
+
+    bump_data_version(user_id)
+    await invalidate_thumbnails(con, user_id, slug)
+
+
+async def run_next_job() -> bool:
+    pool = await get_pool()
+
+    async with pool.acquire() as con:
+        job = await claim_job(con)
+
+    if job is None:
+        return False
+
+    if job["attempts"] > settings.ingest_max_attempts:
+        status, slug, error = "failed", None, "Gave up processing this file"
+    else:
+        try:
+            status, slug, error = "done", await ingest_track(job), None
+        except IngestError as e:
+            status, slug, error = "failed", None, str(e)
+        except Exception:
+            logger.exception(f"Ingest job {job['id']} failed")
+            status, slug, error = "failed", None, "Something went wrong"
+
+    async with pool.acquire() as con:
+        await finish_job(con, job["id"], status, slug, error)
+
+    return True
+
+
+async def ingest_worker():
+    while True:
+        try:
+            found = await run_next_job()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Ingest worker failed to claim a job")
+            found = False
+
+        if found:
+            continue
+
+        try:
+            await asyncio.wait_for(wakeup.wait(), settings.ingest_poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+        wakeup.clear()
+
+
+def start_ingest_workers():
+    if workers:
+        logger.warning("Attempt to start ingest workers when they are already running")
+        return
+
+    for _ in range(settings.ingest_workers):
+        workers.append(asyncio.create_task(ingest_worker()))
+
+
+async def stop_ingest_workers():
+    if not workers:
+        raise Exception("Attempt to stop ingest workers with no ingest workers")
+
+    for task in workers:
+        task.cancel()
+
+    # a job cut off here is left running and picked up again once it times out
+    await asyncio.gather(*workers, return_exceptions=True)
+    workers.clear()
@@ -0,0 +1,226 @@
+import base64
+import json
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from asyncpg import Connection, DataError, Record
+
+from app.fastapi_utils import activity_to_emoji
+from app.settings import settings
+from app.stats import STATS_COLUMNS
+
+
+@dataclass(frozen=True)
+class TrackSort:
+    # never null, so rows can be compared against a cursor, and each one has
+    # an index on (expression, user_id, slug) over the table it comes from
+    expression: str
+    table: str
+    # what the value is cast back to when read out of a cursor
+    type: str
+    descending: bool = True
+
+
+TRACK_SORTS = {
+    "newest": TrackSort("tracks.created_at", "tracks", "timestamp"),
+    "name": TrackSort("tracks.name", "tracks", "text", descending=False),
+    "distance": TrackSort("track_stats.distance", "track_stats", "float8"),
+    "duration": TrackSort(
+        "COALESCE(track_stats.duration, INTERVAL '0')", "track_stats", "interval"
+    ),
+    "elevation": TrackSort(
+        "COALESCE(track_stats.elevation_gain, -1)", "track_stats", "float8"
+    ),
+    "date": TrackSort(
+        "COALESCE(track_stats.started_at, TIMESTAMP '1970-01-01')",
+        "track_stats",
+        "timestamp",
+    ),
+}
+
+# (sort value as text, user id, slug) of the last track on a page
+Cursor = Tuple[str, int, str]
+
+
+def track_sort(sort: Optional[str]) -> TrackSort:
+    if sort is None:
+        return TRACK_SORTS["newest"]
+
+    if sort not in TRACK_SORTS:
+        raise ValueError(f"Invalid sort {sort}")
+
+    return TRACK_SORTS[sort]
+
+
+def encode_cursor(record: Record) -> str:
+    data = json.dumps([record["sort_key"], record["user_id"], record["slug"]])
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, user_id, slug = json.loads(data)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor {cursor}") from e
+
+    if not isinstance(value, str) or not isinstance(user_id, int):
+        raise ValueError(f"Invalid cursor {cursor}")
+
+    return value, user_id, str(slug)
+
+
+def track_page_query(
+    order: TrackSort,
+    after: Optional[str],
+    conditions: List[str],
+    args: list,
+) -> str:
+    # keyset pagination, the page starts right after the cursor's row so
+    # every page costs the same no matter how deep into the listing it is.
+    # the value is bound as text and cast in sql, since it's a string in the
+    # cursor whatever the sort is
+    if after is not None:
+        args.extend(decode_cursor(after))
+        conditions.append(
+            f"({order.expression}, {order.table}.user_id, {order.table}.slug) "
+            f"{'<' if order.descending else '>'} "
+            f"(${len(args) - 2}::text::{order.type}, ${len(args) - 1}, ${len(args)})"
+        )
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    direction = "DESC" if order.descending else "ASC"
+    ordering = (
+        f"{order.expression} {direction}, "
+        f"{order.table}.user_id {direction}, "
+        f"{order.table}.slug {direction}"
+    )
+
+    args.append(settings.page_size + 1)
+
+    return f"""
+        SELECT
+            tracks.slug,
+            tracks.name,
+            tracks.activity,
+            tracks.user_id,
+            tracks.geometry_hash,
+            users.username,
+            {STATS_COLUMNS},
+            ({order.expression})::text AS sort_key,
+            ROW_NUMBER() OVER (ORDER BY {ordering}) AS position
+        FROM tracks
+        JOIN users ON tracks.user_id = users.id
+        JOIN track_stats
+            ON track_stats.user_id = tracks.user_id AND track_stats.slug = tracks.slug
+        {where}
+        ORDER BY {ordering}
+        LIMIT ${len(args)}
+    """
+
+
+async def fetch_page(con: Connection, query: str, args: list, after: Optional[str]):
+    try:
+        return await con.fetch(query, *args)
+    except DataError as e:
+        # a cursor from another sort decodes fine but won't cast to this one
+        raise ValueError(f"Invalid cursor {after}") from e
+
+
+def track_page(records: List[Record]) -> Tuple[List[Record], Optional[str]]:
+    if len(records) <= settings.page_size:
+        return records, None
+
+    records = records[: settings.page_size]
+
+    return records, encode_cursor(records[-1])
+
+
+async def fetch_track_page(
+    con: Connection,
+    sort: Optional[str] = None,
+    after: Optional[str] = None,
+    username: Optional[str] = None,
+    activity: Optional[str] = None,
+) -> Tuple[List[Record], Optional[str]]:
+    order = track_sort(sort)
+
+    conditions = []
+    args = []
+
+    # an empty filter box means no filter
+    if username:
+        args.append(username)
+        conditions.append(f"users.username = ${len(args)}")
+
+    if activity:
+        args.append(activity)
+        conditions.append(f"tracks.activity = ${len(args)}")
+
+    query = track_page_query(order, after, conditions, args)
+
+    return track_page(await fetch_page(con, query, args, after))
+
+
+async def fetch_user_track_page(
+    con: Connection,
+    username: str,
+    sort: Optional[str] = None,
+    after: Optional[str] = None,
+    activity: Optional[str] = None,
+) -> Tuple[Optional[Record], List[Record], Optional[str]]:
+    # the user and their page of tracks in one round trip. the user comes
+    # back with null tracks when they have none, and nothing when they
+    # don't exist
+    order = track_sort(sort)
+
+    args = [username]
+    conditions = ["tracks.user_id = owner.id"]
+
+    if activity:
+        args.append(activity)
+        conditions.append(f"tracks.activity = ${len(args)}")
+
+    query = track_page_query(order, after, conditions, args)
+
+    records = await fetch_page(
+        con,
+        f"""
+        SELECT owner.id AS owner_id, owner.username AS owner_username, page.*
+        FROM users AS owner
+        LEFT JOIN LATERAL ({query}) AS page ON true
+        WHERE owner.username = $1
+        ORDER BY page.position
+        """,
+        args,
+        after,
+    )
+
+    if not records:
+        return None, [], None
+
+    owner = records[0]
+    records, cursor = track_page(
+        [record for record in records if record["slug"] is not None]
+    )
+
+    return owner, records, cursor
+
+
+def listing_tracks(records: List[Record]) -> List[dict]:
+    return [
+        {
+            "user_id": record["user_id"],
+            "username": record["username"],
+            "slug": record["slug"],
+            "geometry_hash": record["geometry_hash"],
+            "name": record["name"],
+            "activity": record["activity"],
+            "activity_emoji": activity_to_emoji(record["activity"]),
+            "bounds": [record["minx"], record["miny"], record["maxx"], record["maxy"]],
+            "distance": record["distance"],
+            "duration": record["duration"],
+            "elevation_gain": record["elevation_gain"],
+        }
+        for record in records
+    ]
@@ -0,0 +1,69 @@
+import math
+from typing import Optional, Dict, Any
+
+# (geometry column, polyline column, simplify tolerance in degrees), coarsest
+# first, these have to match the generated columns in
+# db/migrations/000005_add_track_lods.up.sql and
+# db/migrations/000008_add_track_polylines.up.sql
+LOD_TIERS = (
+    ("geometry_lod0", "polyline_lod0", 0.01),
+    ("geometry_lod1", "polyline_lod1", 0.001),
+    ("geometry_lod2", "polyline_lod2", 0.0001),
+    ("geometry", "polyline", 0.0),
+)
+
+TILE_SIZE = 256
+MAX_ZOOM = 19
+
+
+def degrees_per_pixel(zoom: float) -> float:
+    return 360 / (TILE_SIZE * 2**zoom)
+
+
+def max_zoom_for_tolerance(tolerance: float) -> int:
+    if tolerance <= 0:
+        return MAX_ZOOM
+
+    return math.floor(math.log2(360 / (TILE_SIZE * tolerance)))
+
+
+def lod_tier(zoom: Optional[float]) -> int:
+    if zoom is None:
+        return 0
+
+    for tier, (_, _, tolerance) in enumerate(LOD_TIERS):
+        if tolerance <= degrees_per_pixel(zoom):
+            return tier
+
+    return len(LOD_TIERS) - 1
+
+
+def lod_column(tier: int) -> str:
+    return LOD_TIERS[tier][0]
+
+
+def lod_polyline_column(tier: int) -> str:
+    return LOD_TIERS[tier][1]
+
+
+def lod_decimals(tier: int) -> int:
+    tolerance = LOD_TIERS[tier][2]
+
+    # one digit finer than the simplification error, 6 digits is ~10cm, this
+    # is also the precision the polyline columns are encoded with
+    if tolerance <= 0:
+        return 6
+
+    return min(math.ceil(-math.log10(tolerance)) + 1, 6)
+
+
+def lod_info(tier: int) -> Dict[str, Any]:
+    min_zoom = 0
+    if tier > 0:
+        min_zoom = max_zoom_for_tolerance(LOD_TIERS[tier - 1][2]) + 1
+
+    return {
+        "tier": tier,
+        "min_zoom": min_zoom,
+        "max_zoom": max_zoom_for_tolerance(LOD_TIERS[tier][2]),
+    }
@@ -2,18 +2,30 @@ from contextlib import asynccontextmanager
 
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse
 
 from app.db import create_pool, close_pool
+from app.metrics import MetricsMiddleware, start_profiler, stop_profiler
+from app.static_files import PrecompressedStaticFiles
+from app.ingest import start_ingest_workers, stop_ingest_workers
+from app.render_pool import (
+    start_render_pool,
+    stop_render_pool,
+    warm_render_pool,
+    warm_up_worker,
+)
+from app.versions import start_listener, stop_listener
 from app.settings import settings
 from app.routes import (
     admin_router,
     homepage_router,
     login_router,
     logout_router,
+    metrics_router,
     profile_router,
     register_router,
+    sprites_router,
+    tiles_router,
     upload_router,
 )
 
@@ -21,14 +33,34 @@ from app.routes import (
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await create_pool()
+    await start_listener()
+    start_render_pool()
+
+    if not settings.fast_startup:
+        warm_up_worker()
+        await warm_render_pool()
+
+    start_ingest_workers()
+
+    if settings.profile_slow_requests:
+        start_profiler()
+
     yield
+    if settings.profile_slow_requests:
+        stop_profiler()
+
+    await stop_ingest_workers()
+    stop_render_pool()
+    await stop_listener()
     await close_pool()
 
 
 app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(SessionMiddleware, secret_key=settings.session_secret_key)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# added last so it is outermost and its timings cover the session handling
+app.add_middleware(MetricsMiddleware)
+app.mount("/static", PrecompressedStaticFiles(directory="static"), name="static")
 
 app.include_router(homepage_router)
 app.include_router(login_router)
@@ -36,6 +68,9 @@ app.include_router(logout_router)
 app.include_router(register_router)
 app.include_router(admin_router)
 app.include_router(upload_router)
+app.include_router(tiles_router)
+app.include_router(sprites_router)
+app.include_router(metrics_router)
 
 app.include_router(profile_router)
 
@@ -0,0 +1,321 @@
+import asyncio
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from app.settings import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# frames kept from the top of a sampled stack, below this is the event loop
+# and middleware which every sample has in common
+PROFILE_STACK_DEPTH = 12
+
+
+class Histogram:
+    def __init__(
+        self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float]
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> (count per bucket, with +Inf last, sum)
+        self.series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.series.get(labels)
+
+        if series is None:
+            series = self.series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+
+        counts, total = series
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+
+        for labels, (counts, total) in self.series.items():
+            pairs = [
+                f'{name}="{escape(value)}"' for name, value in zip(self.labels, labels)
+            ]
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket = format_labels(pairs + [f'le="{le}"'])
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+
+            lines.append(f"{self.name}_sum{format_labels(pairs)} {total[0]}")
+            lines.append(f"{self.name}_count{format_labels(pairs)} {cumulative}")
+
+        return lines
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(pairs: List[str]) -> str:
+    return f"{{{','.join(pairs)}}}" if pairs else ""
+
+
+request_seconds = Histogram(
+    "trackslat_request_seconds",
+    "Time from a request arriving to its response being sent",
+    ["method", "route", "status"],
+    LATENCY_BUCKETS,
+)
+request_db_seconds = Histogram(
+    "trackslat_request_db_seconds",
+    "Time a request spent waiting on queries",
+    ["route"],
+    LATENCY_BUCKETS,
+)
+request_render_seconds = Histogram(
+    "trackslat_request_render_seconds",
+    "Time a request spent waiting on the render pool",
+    ["route"],
+    LATENCY_BUCKETS,
+)
+pool_wait_seconds = Histogram(
+    "trackslat_pool_wait_seconds",
+    "Time spent waiting for a free connection from the pool",
+    [],
+    LATENCY_BUCKETS,
+)
+render_seconds = Histogram(
+    "trackslat_render_seconds",
+    "Time from a render being submitted to the pool to it finishing",
+    ["fn"],
+    LATENCY_BUCKETS,
+)
+response_bytes = Histogram(
+    "trackslat_response_bytes",
+    "Size of response bodies, after any compression",
+    ["route"],
+    SIZE_BUCKETS,
+)
+
+HISTOGRAMS = [
+    request_seconds,
+    request_db_seconds,
+    request_render_seconds,
+    pool_wait_seconds,
+    render_seconds,
+    response_bytes,
+]
+
+
+@dataclass
+class RequestTimings:
+    db: float = 0.0
+    render: float = 0.0
+    pool_wait: float = 0.0
+    # collapsed stacks from the profiler, only filled in while it's running
+    samples: Counter = field(default_factory=Counter)
+
+
+# timings of the request being handled by the current task, anything timed
+# outside a request (ingest workers, the listener) only goes to the totals
+current_timings: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "current_timings", default=None
+)
+
+
+def add_db_time(seconds: float):
+    timings = current_timings.get()
+
+    if timings is not None:
+        timings.db += seconds
+
+
+def add_render_time(seconds: float):
+    timings = current_timings.get()
+
+    if timings is not None:
+        timings.render += seconds
+
+
+def add_pool_wait(seconds: float):
+    pool_wait_seconds.observe(seconds)
+
+    timings = current_timings.get()
+
+    if timings is not None:
+        timings.pool_wait += seconds
+
+
+def route_label(scope) -> str:
+    # the route template rather than the path, so there is one series per
+    # route instead of one per track. mounts only set their root path
+    route = scope.get("route")
+
+    return getattr(route, "path", None) or scope.get("root_path") or "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+
+        status = 500
+        size = 0
+        task = asyncio.current_task()
+
+        async def send_wrapper(message):
+            nonlocal status, size
+
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+
+            await send(message)
+
+        if profiler is not None:
+            profiler.watch(task, timings)
+
+        start = time.perf_counter()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+
+            if profiler is not None:
+                profiler.unwatch(task)
+
+            current_timings.reset(token)
+
+            route = route_label(scope)
+
+            request_seconds.observe(elapsed, scope["method"], route, str(status))
+            request_db_seconds.observe(timings.db, route)
+            request_render_seconds.observe(timings.render, route)
+            response_bytes.observe(size, route)
+
+            if elapsed >= settings.slow_request_seconds:
+                log_slow_request(scope, elapsed, timings)
+
+
+def log_slow_request(scope, elapsed: float, timings: RequestTimings):
+    logger.warning(
+        f"Slow request {scope['method']} {scope['path']} took {elapsed:.3f}s "
+        f"(db {timings.db:.3f}s, render {timings.render:.3f}s, "
+        f"pool wait {timings.pool_wait:.3f}s)"
+    )
+
+    if not timings.samples:
+        return
+
+    total = sum(timings.samples.values())
+
+    for stack, count in timings.samples.most_common(settings.profile_top_stacks):
+        logger.warning(f"  {count / total:5.1%} {stack}")
+
+
+class SamplingProfiler:
+    # a thread that looks at what the event loop is running every interval
+    # and charges the stack to whichever watched request's task that is.
+    # only requests that turn out to be slow have their samples logged
+    def __init__(self, loop: asyncio.AbstractEventLoop, interval: float):
+        self.loop = loop
+        self.interval = interval
+        self.loop_thread = threading.get_ident()
+        self.watched: Dict[asyncio.Task, RequestTimings] = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+
+    def watch(self, task: Optional[asyncio.Task], timings: RequestTimings):
+        if task is not None:
+            self.watched[task] = timings
+
+    def unwatch(self, task: Optional[asyncio.Task]):
+        self.watched.pop(task, None)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            task = asyncio.current_task(self.loop)
+            timings = self.watched.get(task)
+
+            if timings is None:
+                continue
+
+            frame = sys._current_frames().get(self.loop_thread)
+
+            if frame is not None:
+                timings.samples[collapse_stack(frame)] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def collapse_stack(frame) -> str:
+    stack = []
+
+    while frame is not None and len(stack) < PROFILE_STACK_DEPTH:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+        frame = frame.f_back
+
+    # outermost first, the same order flamegraph tools expect
+    return ";".join(reversed(stack))
+
+
+profiler: Optional[SamplingProfiler] = None
+
+
+def start_profiler():
+    global profiler
+
+    if profiler is not None:
+        logger.warning("Attempt to start profiler when it is already running")
+        return
+
+    profiler = SamplingProfiler(asyncio.get_running_loop(), settings.profile_interval)
+    profiler.start()
+
+
+def stop_profiler():
+    global profiler
+
+    if profiler is None:
+        raise Exception("Attempt to stop profiler with no profiler")
+
+    profiler.stop()
+    profiler = None
+
+
+def render_metrics(gauges: Dict[str, Tuple[str, float]]) -> str:
+    lines = []
+
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+
+    for name, (help, value) in gauges.items():
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+
+    return "\n".join(lines) + "\n"
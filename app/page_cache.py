@@ -0,0 +1,135 @@
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from markupsafe import Markup
+
+from app.cache import LRUCache
+from app.fastapi_utils import templates, etag_matches, wants_fragment
+from app.settings import settings
+from app.versions import data_version
+
+# rendered in place of the session header, which is the only part of a page
+# that depends on who is looking at it, and swapped for theirs when served
+SESSION_HEADER = "<!-- session header -->"
+
+
+@dataclass
+class CachedPage:
+    # whose data version the page was built from, None for everyone's
+    user_id: Optional[int]
+    version: int
+    # the page either side of the session header, fragments have no header
+    # and are all in before
+    before: bytes
+    after: bytes
+    has_header: bool
+    digest: str
+    modified: datetime
+
+    def __len__(self) -> int:
+        return len(self.before) + len(self.after)
+
+
+page_cache: LRUCache[tuple] = LRUCache(settings.page_cache_max_bytes)
+
+
+def page_key(request: Request, *extra) -> tuple:
+    return (
+        request.url.path,
+        tuple(sorted(request.query_params.multi_items())),
+        wants_fragment(request),
+        *extra,
+    )
+
+
+def session_header(request: Request) -> bytes:
+    return (
+        templates.get_template("session_header.html")
+        .render(user=request.session.get("user"))
+        .encode("utf-8")
+    )
+
+
+def page_response(request: Request, page: CachedPage) -> Response:
+    header = session_header(request)
+    digest = hashlib.md5(header).hexdigest()[:8]
+
+    headers = {
+        "ETag": f'"{page.digest}-{digest}"',
+        "Last-Modified": format_datetime(page.modified, usegmt=True),
+        # the header differs per session, so only the browser may keep it
+        "Cache-Control": "private, no-cache",
+        "Vary": "Cookie, HX-Request",
+    }
+
+    if etag_matches(request, headers["ETag"]) or not_modified_since(request, page):
+        return Response(status_code=304, headers=headers)
+
+    body = page.before + header + page.after if page.has_header else page.before
+
+    return Response(body, media_type="text/html", headers=headers)
+
+
+def not_modified_since(request: Request, page: CachedPage) -> bool:
+    # only used when there is no etag to go on
+    if "if-none-match" in request.headers:
+        return False
+
+    if_modified_since = request.headers.get("if-modified-since")
+
+    if if_modified_since is None:
+        return False
+
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+    return page.modified.replace(microsecond=0) <= since
+
+
+def cached_page(request: Request, key: tuple) -> Optional[Response]:
+    page = page_cache.get(key)
+
+    if page is None or page.version != data_version(page.user_id):
+        return None
+
+    return page_response(request, page)
+
+
+def render_page(
+    request: Request,
+    key: tuple,
+    name: str,
+    context: dict,
+    user_id: Optional[int],
+    since: int,
+) -> Response:
+    # since is the global data version from before the page's queries ran.
+    # every write bumps that too, so if the user's version has passed it
+    # something changed under the queries and the entry starts out stale
+    version = min(data_version(user_id), since)
+
+    body = templates.TemplateResponse(
+        name, {**context, "session_header": Markup(SESSION_HEADER)}
+    ).body
+
+    before, marker, after = body.partition(SESSION_HEADER.encode("utf-8"))
+
+    page = CachedPage(
+        user_id=user_id,
+        version=version,
+        before=before,
+        after=after,
+        has_header=bool(marker),
+        digest=hashlib.md5(body).hexdigest()[:16],
+        modified=datetime.now(timezone.utc),
+    )
+    page_cache.put(key, page)
+
+    return page_response(request, page)
@@ -0,0 +1,161 @@
+import struct
+import zlib
+from typing import List, Optional
+
+import numpy as np
+import shapely
+
+# roughly what matplotlib produced: a 2pt line at 100dpi inside a ~500px axes
+RENDER_SIZE = 512
+STROKE_WIDTH = 2.8
+
+# distance between stamps along a segment, in pixels
+SAMPLE_STEP = 0.5
+
+# in pixels, applied before drawing
+SIMPLIFY_TOLERANCE = 0.25
+
+# how many stamped samples to splat at once, bounds peak memory on huge tracks
+CHUNK_SIZE = 65536
+
+
+def track_segments(geometry) -> tuple[np.ndarray, np.ndarray]:
+    parts = shapely.get_parts(geometry)
+    coords = shapely.get_coordinates(parts)
+    counts = shapely.get_num_coordinates(parts)
+
+    connected = np.ones(max(len(coords) - 1, 0), dtype=bool)
+    part_ends = np.cumsum(counts)[:-1] - 1
+    connected[part_ends[part_ends < len(connected)]] = False
+
+    return coords, connected
+
+
+def projection(geometry, size: int, padding: float):
+    minx, miny, maxx, maxy = shapely.bounds(geometry)
+    span = max(maxx - minx, maxy - miny)
+    scale = (size - 2 * padding) / span if span > 0 else 0.0
+
+    width = int(np.ceil((maxx - minx) * scale + 2 * padding))
+    height = int(np.ceil((maxy - miny) * scale + 2 * padding))
+
+    return (minx, miny), scale, width, height
+
+
+def sample_segments(
+    pixels: np.ndarray, connected: np.ndarray, step: float
+) -> np.ndarray:
+    starts = pixels[:-1][connected]
+    deltas = (pixels[1:] - pixels[:-1])[connected]
+
+    lengths = np.hypot(deltas[:, 0], deltas[:, 1])
+    steps = np.maximum(np.ceil(lengths / step), 1).astype(np.int64)
+
+    segment = np.repeat(np.arange(len(steps)), steps)
+    offset = np.arange(len(segment)) - np.repeat(np.cumsum(steps) - steps, steps)
+    t = (offset / steps[segment])[:, None]
+
+    return np.concatenate([starts[segment] + t * deltas[segment], pixels])
+
+
+def stamp(alpha: np.ndarray, samples: np.ndarray, stroke_width: float):
+    height, width = alpha.shape
+    radius = stroke_width / 2
+    reach = int(np.ceil(radius + 0.5))
+
+    dy, dx = np.mgrid[-reach : reach + 1, -reach : reach + 1]
+    dx = dx.ravel()
+    dy = dy.ravel()
+
+    flat = alpha.reshape(-1)
+
+    for chunk in range(0, len(samples), CHUNK_SIZE):
+        points = samples[chunk : chunk + CHUNK_SIZE]
+        base = np.floor(points).astype(np.int64)
+
+        px = base[:, 0:1] + dx
+        py = base[:, 1:2] + dy
+
+        distance = np.hypot(px + 0.5 - points[:, 0:1], py + 0.5 - points[:, 1:2])
+        coverage = np.clip(radius + 0.5 - distance, 0.0, 1.0)
+
+        inside = (coverage > 0) & (px >= 0) & (px < width) & (py >= 0) & (py < height)
+
+        np.maximum.at(flat, py[inside] * width + px[inside], coverage[inside])
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    height, width, _ = rgba.shape
+
+    # every scanline gets a leading 0 byte, filter type "none"
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return (
+            struct.pack(">I", len(data))
+            + tag
+            + data
+            + struct.pack(">I", zlib.crc32(tag + data))
+        )
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+def rasterize(
+    geometry, size: int = RENDER_SIZE, stroke_width: float = STROKE_WIDTH
+) -> np.ndarray:
+    origin, scale, width, height = projection(geometry, size, padding=stroke_width)
+
+    # anything closer than a fraction of a pixel can't be seen, dropping it
+    # here is what keeps dense gps tracks cheap to draw
+    if scale > 0:
+        geometry = shapely.simplify(
+            geometry, SIMPLIFY_TOLERANCE / scale, preserve_topology=False
+        )
+
+    coords, connected = track_segments(geometry)
+
+    pixels = (coords - origin) * scale + stroke_width
+    pixels[:, 1] = height - pixels[:, 1]
+
+    alpha = np.zeros((height, width), dtype=np.float32)
+    stamp(alpha, sample_segments(pixels, connected, SAMPLE_STEP), stroke_width)
+
+    rgba = np.full((height, width, 4), 255, dtype=np.uint8)
+    rgba[:, :, 3] = np.rint(alpha * 255)
+
+    return rgba
+
+
+def render_track_png(wkb) -> bytes:
+    return encode_png(rasterize(shapely.from_wkb(wkb)))
+
+
+def render_sprite_png(wkbs: List[Optional[bytes]], cell_size: int) -> bytes:
+    # one cell per track stacked top to bottom, drawn to look like a scaled
+    # down thumbnail, a missing track leaves its cell empty
+    sprite = np.full((cell_size * len(wkbs), cell_size, 4), 255, dtype=np.uint8)
+    sprite[:, :, 3] = 0
+
+    stroke_width = STROKE_WIDTH * cell_size / RENDER_SIZE
+
+    for index, wkb in enumerate(wkbs):
+        if wkb is None:
+            continue
+
+        cell = rasterize(shapely.from_wkb(wkb), cell_size, stroke_width)
+        cell = cell[:cell_size, :cell_size]
+
+        height, width, _ = cell.shape
+        top = index * cell_size + (cell_size - height) // 2
+        left = (cell_size - width) // 2
+
+        sprite[top : top + height, left : left + width] = cell
+
+    return encode_png(sprite)
@@ -0,0 +1,134 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Callable, Dict, Hashable
+
+from loguru import logger
+
+from app.metrics import add_render_time, render_seconds
+from app.settings import settings
+
+executor: Optional[ProcessPoolExecutor] = None
+
+# renders that have been submitted but not finished, keyed by thumbnail key,
+# so concurrent requests for the same track share one render
+in_flight: Dict[Hashable, asyncio.Future] = {}
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+def start_render_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    global executor
+
+    if executor is None:
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers or settings.render_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    else:
+        logger.warning("Attempt to start render pool when it is already running")
+
+    return executor
+
+
+def stop_render_pool() -> None:
+    global executor
+
+    if executor is None:
+        raise Exception("Attempt to stop render pool with no render pool")
+
+    executor.shutdown(wait=False, cancel_futures=True)
+    executor = None
+    in_flight.clear()
+
+
+def warm_up_worker() -> None:
+    # also run in the web process, which uses parts of these outside the pool
+    import app.density  # noqa: F401
+    import app.gpx  # noqa: F401
+    import app.rasterizer  # noqa: F401
+
+
+async def warm_render_pool() -> None:
+    executor = get_render_pool()
+    loop = asyncio.get_running_loop()
+
+    await asyncio.gather(
+        *[
+            loop.run_in_executor(executor, warm_up_worker)
+            for _ in range(settings.render_workers)
+        ]
+    )
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    if executor is None:
+        raise Exception("Attempt to get render pool with no render pool")
+
+    return executor
+
+
+async def render(key: Hashable, fn: Callable, *args, wait: bool = False):
+    future = in_flight.get(key)
+
+    while future is None and len(in_flight) >= settings.render_queue_depth:
+        if not wait:
+            raise RenderQueueFull()
+
+        # background work waits for room in the queue rather than failing
+        await asyncio.wait(
+            list(in_flight.values()), return_when=asyncio.FIRST_COMPLETED
+        )
+        future = in_flight.get(key)
+
+    if future is None:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(get_render_pool(), fn, *args)
+
+        in_flight[key] = future
+        future.add_done_callback(finish_render(key, fn.__name__))
+
+    start = time.perf_counter()
+
+    try:
+        # a client going away shouldn't cancel a render others are waiting on
+        return await asyncio.shield(future)
+    finally:
+        add_render_time(time.perf_counter() - start)
+
+
+def finish_render(key: Hashable, name: str) -> Callable:
+    start = time.perf_counter()
+
+    def done(_):
+        in_flight.pop(key, None)
+        render_seconds.observe(time.perf_counter() - start, name)
+
+    return done
+
+
+async def run_in_pool(fn: Callable, *args):
+    # for work nothing else could share, ingests and imports, which counts
+    # against the queue like renders do so requests see how busy the pool is
+    return await render(object(), fn, *args, wait=True)
+
+
+async def render_png(key: Hashable, wkb) -> bytes:
+    from app.rasterizer import render_track_png
+
+    return await render(key, render_track_png, wkb)
+
+
+async def render_sprite(key: Hashable, wkbs, cell_size: int) -> bytes:
+    from app.rasterizer import render_sprite_png
+
+    return await render(key, render_sprite_png, wkbs, cell_size)
+
+
+async def render_heatmap(key: Hashable, counts: Optional[bytes]) -> bytes:
+    from app.density import render_heatmap_png
+
+    return await render(key, render_heatmap_png, counts, settings.heatmap_saturation)
@@ -2,8 +2,11 @@ from app.routes.admin import router as admin_router
 from app.routes.homepage import router as homepage_router
 from app.routes.login import router as login_router
 from app.routes.logout import router as logout_router
+from app.routes.metrics import router as metrics_router
 from app.routes.profile import router as profile_router
 from app.routes.register import router as register_router
+from app.routes.sprites import router as sprites_router
+from app.routes.tiles import router as tiles_router
 from app.routes.upload import router as upload_router
 
 __all__ = [
@@ -11,7 +14,10 @@ __all__ = [
     homepage_router,
     login_router,
     logout_router,
+    metrics_router,
     profile_router,
     register_router,
+    sprites_router,
+    tiles_router,
     upload_router,
 ]
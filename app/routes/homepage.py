@@ -1,85 +1,102 @@
-from fastapi import Request, Depends, APIRouter
-from asyncpg import Connection
+from fastapi import Request, APIRouter
+from fastapi.responses import PlainTextResponse
 
-from app.db import get_connection_from_pool
-from app.fastapi_utils import templates, not_found_resp, activity_to_emoji
+from app.db import acquire_connection
+from app.fastapi_utils import (
+    not_found_resp,
+    parse_bbox,
+    wants_fragment,
+    url_with,
+)
+from app.feed import json_response, ndjson_response, fetch_aggregates
+from app.listing import TRACK_SORTS, fetch_track_page, listing_tracks
+from app.page_cache import cached_page, page_key, render_page
+from app.settings import settings
+from app.sprites import sprite_url
+from app.versions import data_version
 
 router = APIRouter()
 
 
-async def html_template(request: Request, con: Connection):
-    records = await con.fetch(
-        """
-        SELECT
-            slug, name, activity, username
-        FROM
-            tracks
-        JOIN
-            users ON tracks.user_id = users.id
-    """
-    )
+async def html_template(
+    request: Request,
+    sort: str = None,
+    after: str = None,
+    activity: str = None,
+    user: str = None,
+):
+    key = page_key(request)
+    cached = cached_page(request, key)
 
-    tracks = [
-        {
-            "username": record["username"],
-            "slug": record["slug"],
-            "name": record["name"],
-            "activity_emoji": activity_to_emoji(record["activity"]),
-        }
-        for record in records
-    ]
-
-    return templates.TemplateResponse(
-        "index.html",
+    if cached is not None:
+        return cached
+
+    since = data_version()
+
+    async with acquire_connection() as con:
+        records, cursor = await fetch_track_page(
+            con, sort, after, username=user, activity=activity
+        )
+
+    tracks = listing_tracks(records)
+
+    return render_page(
+        request,
+        key,
+        "index_tracks.html" if wants_fragment(request) else "index.html",
         {
             "request": request,
             "tracks": tracks,
+            "sprite_url": sprite_url(tracks),
+            "next_url": cursor and url_with(request, after=cursor),
+            "sort": sort,
+            "sorts": TRACK_SORTS,
+            "activity": activity,
+            "filter_user": user,
+            "heatmap_max_zoom": settings.heatmap_max_zoom,
         },
+        None,
+        since,
     )
 
 
-async def json_data(con: Connection):
-    aggregates = await con.fetchrow(
-        """
-        SELECT
-            ST_AsGeoJSON(ST_Centroid(ST_Extent(geometry)))::json as center,
-            ST_AsGeoJSON(ST_Extent(geometry))::json as extent
-        FROM
-            tracks
-    """
-    )
-
-    tracks = await con.fetch(
-        """
-        SELECT
-            slug,
-            name,
-            activity,
-            username,
-            ST_AsGeoJSON(geometry)::json as geometry
-        FROM
-            tracks
-        JOIN
-            users ON tracks.user_id = users.id
-    """
-    )
-
-    return {
-        "aggregates": aggregates,
-        "tracks": tracks,
-    }
-
-
 @router.get("/lon/")
 async def display_root_route(
     request: Request,
-    con: Connection = Depends(get_connection_from_pool),
     format: str = None,
+    zoom: float = None,
+    bbox: str = None,
+    sort: str = None,
+    after: str = None,
+    activity: str = None,
+    user: str = None,
 ):
     if format is None or format == "html":
-        return await html_template(request, con)
+        try:
+            return await html_template(request, sort, after, activity, user)
+        except ValueError:
+            return PlainTextResponse("Invalid sort or cursor", status_code=400)
 
     if format == "json":
-        return await json_data(con)
+        try:
+            return await json_response(request, zoom, parse_bbox(bbox))
+        except ValueError:
+            return PlainTextResponse("Invalid bbox", status_code=400)
+
+    if format == "ndjson":
+        try:
+            return ndjson_response(request, zoom, parse_bbox(bbox))
+        except ValueError:
+            return PlainTextResponse("Invalid bbox", status_code=400)
+
+    if format == "polyline":
+        try:
+            return ndjson_response(request, zoom, parse_bbox(bbox), encoding="polyline")
+        except ValueError:
+            return PlainTextResponse("Invalid bbox", status_code=400)
+
+    if format == "aggregates":
+        async with acquire_connection() as con:
+            return {"aggregates": await fetch_aggregates(con)}
 
     return not_found_resp(request)
@@ -31,7 +31,7 @@ async def login_route(
         username,
     )
 
-    if user is None or not check_password(password, user["password_hash"]):
+    if user is None or not await check_password(password, user["password_hash"]):
         # TODO this should be a flash message instead
         return "Invalid username or password"
 
@@ -0,0 +1,53 @@
+import hmac
+
+from fastapi import APIRouter, Request
+from fastapi.responses import Response
+
+from app.db import pool_stats
+from app.metrics import render_metrics
+from app.render_pool import in_flight
+from app.settings import settings
+
+router = APIRouter()
+
+
+def can_see_metrics(request: Request) -> bool:
+    user = request.session.get("user")
+
+    if user is not None and user["role"] == "admin":
+        return True
+
+    if settings.metrics_token is None:
+        return False
+
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+
+    return scheme.lower() == "bearer" and hmac.compare_digest(
+        token.encode("utf-8"), settings.metrics_token.encode("utf-8")
+    )
+
+
+@router.get("/metrics")
+async def metrics_route(request: Request):
+    # timings and pool state aren't for the public, who get a plain not found
+    if not can_see_metrics(request):
+        return Response(status_code=404)
+
+    stats = pool_stats()
+
+    body = render_metrics(
+        {
+            "trackslat_pool_size": ("Connections open in the pool", stats["size"]),
+            "trackslat_pool_in_use": ("Connections checked out", stats["in_use"]),
+            "trackslat_pool_waiters": (
+                "Requests waiting for a connection",
+                stats["waiters"],
+            ),
+            "trackslat_renders_in_flight": (
+                "Renders submitted to the pool and not yet finished",
+                len(in_flight),
+            ),
+        }
+    )
+
+    return Response(body, media_type="text/plain; version=0.0.4; charset=utf-8")
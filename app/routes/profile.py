@@ -1,56 +1,142 @@
 from typing import Annotated
 
 from fastapi import APIRouter, Request, Depends, Form
-from fastapi.responses import StreamingResponse, RedirectResponse
+from fastapi.responses import Response, RedirectResponse, PlainTextResponse
 from asyncpg import Connection
-import io
 
-import shapely
-import geopandas as gpd
-import matplotlib.pyplot as plt
-
-from app.db import get_connection_from_pool
-from app.fastapi_utils import templates, not_found_resp, activity_to_emoji
+from app.db import (
+    acquire_connection,
+    fetch_track_details,
+    fetch_track_ref,
+    fetch_user,
+    get_connection_from_pool,
+)
+from app.fastapi_utils import (
+    not_found_resp,
+    activity_to_emoji,
+    etag_matches,
+    parse_bbox,
+    wants_fragment,
+    url_with,
+)
+from app.feed import json_response, ndjson_response, fetch_aggregates
+from app.ingest import delete_track
+from app.listing import TRACK_SORTS, fetch_user_track_page, listing_tracks
+from app.page_cache import cached_page, page_key, render_page
+from app.render_pool import render_png, RenderQueueFull
+from app.sprites import sprite_url
+from app.svg import svg_key, svg_etag, fetch_track_svg, render_svg
+from app.thumbnails import (
+    memory_cache,
+    thumbnail_key,
+    thumbnail_etag,
+    get_thumbnail,
+    store_thumbnail,
+)
+from app.versions import data_version
 
 router = APIRouter()
 
 
-@router.get("/lon/{username}")
-async def display_user_route(
-    request: Request, username: str, con: Connection = Depends(get_connection_from_pool)
+async def user_page(
+    request: Request,
+    username: str,
+    sort: str = None,
+    after: str = None,
+    activity: str = None,
 ):
-    user = await con.fetchrow(
-        "SELECT id, username FROM users WHERE username = $1",
-        username,
-    )
+    # owners get delete buttons, everyone else shares one copy of the page
+    viewer = request.session.get("user")
+    is_owner = viewer is not None and viewer["username"] == username
+
+    key = page_key(request, is_owner)
+    cached = cached_page(request, key)
+
+    if cached is not None:
+        return cached
+
+    since = data_version()
+
+    try:
+        async with acquire_connection() as con:
+            user, records, cursor = await fetch_user_track_page(
+                con, username, sort, after, activity
+            )
+    except ValueError:
+        return PlainTextResponse("Invalid sort or cursor", status_code=400)
 
     if user is None:
         return not_found_resp(request)
 
-    records = await con.fetch(
-        "SELECT slug, name, activity FROM tracks WHERE user_id = $1", user["id"]
-    )
+    tracks = listing_tracks(records)
 
-    tracks = [
-        {
-            "slug": record["slug"],
-            "name": record["name"],
-            "activity_emoji": activity_to_emoji(record["activity"]),
-            "username": username,
-        }
-        for record in records
-    ]
-
-    return templates.TemplateResponse(
-        "user.html",
+    return render_page(
+        request,
+        key,
+        "user_tracks.html" if wants_fragment(request) else "user.html",
         {
             "request": request,
-            "username": user["username"],
+            "username": user["owner_username"],
             "tracks": tracks,
+            "sprite_url": sprite_url(tracks),
+            "next_url": cursor and url_with(request, after=cursor),
+            "sort": sort,
+            "sorts": TRACK_SORTS,
+            "activity": activity,
         },
+        user["owner_id"],
+        since,
     )
 
 
+@router.get("/lon/{username}")
+async def display_user_route(
+    request: Request,
+    username: str,
+    format: str = None,
+    zoom: float = None,
+    bbox: str = None,
+    sort: str = None,
+    after: str = None,
+    activity: str = None,
+):
+    if format is None or format == "html":
+        return await user_page(request, username, sort, after, activity)
+
+    if format == "json":
+        try:
+            response = await json_response(request, zoom, parse_bbox(bbox), username)
+        except ValueError:
+            return PlainTextResponse("Invalid bbox", status_code=400)
+
+        return response or not_found_resp(request)
+
+    async with acquire_connection() as con:
+        user = await fetch_user(con, username)
+
+        if user is None:
+            return not_found_resp(request)
+
+        if format == "ndjson":
+            try:
+                return ndjson_response(request, zoom, parse_bbox(bbox), user["id"])
+            except ValueError:
+                return PlainTextResponse("Invalid bbox", status_code=400)
+
+        if format == "polyline":
+            try:
+                return ndjson_response(
+                    request, zoom, parse_bbox(bbox), user["id"], "polyline"
+                )
+            except ValueError:
+                return PlainTextResponse("Invalid bbox", status_code=400)
+
+        if format == "aggregates":
+            return {"aggregates": await fetch_aggregates(con, user["id"])}
+
+    return not_found_resp(request)
+
+
 @router.get("/lon/{username}/{slug}.png")
 async def display_track_as_png(
     request: Request,
@@ -58,36 +144,78 @@ async def display_track_as_png(
     slug: str,
     con: Connection = Depends(get_connection_from_pool),
 ):
-    record = await con.fetchrow(
-        """
-        SELECT
-            geometry
-        FROM tracks
-        JOIN users ON tracks.user_id = users.id
-        WHERE users.username = $1 AND tracks.slug = $2
-        """,
-        username,
-        slug,
-    )
+    record = await fetch_track_ref(con, username, slug)
+
+    if record is None:
+        return not_found_resp(request)
+
+    headers = {
+        "ETag": thumbnail_etag(record["geometry_hash"]),
+        "Cache-Control": "no-cache",
+    }
+
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    key = thumbnail_key(record["user_id"], slug, record["geometry_hash"])
+    png = await get_thumbnail(con, key)
+
+    if png is None:
+        wkb_str = await con.fetchval(
+            "SELECT geometry FROM tracks WHERE user_id = $1 AND slug = $2",
+            record["user_id"],
+            slug,
+        )
+
+        try:
+            png = await render_png(key, wkb_str)
+        except RenderQueueFull:
+            return Response(status_code=503, headers={"Retry-After": "1"})
+
+        await store_thumbnail(con, key, png)
+
+    return Response(png, media_type="image/png", headers=headers)
+
+
+@router.get("/lon/{username}/{slug}.svg")
+async def display_track_as_svg(
+    request: Request,
+    username: str,
+    slug: str,
+    v: str = None,
+    con: Connection = Depends(get_connection_from_pool),
+):
+    record = await fetch_track_ref(con, username, slug)
 
     if record is None:
         return not_found_resp(request)
 
-    wkb_str = record.get("geometry")
-    wkb = shapely.wkb.loads(wkb_str)
+    # ?v= names the geometry, while it's the current one the url can't change
+    headers = {
+        "ETag": svg_etag(record["geometry_hash"]),
+        "Cache-Control": (
+            "public, max-age=31536000, immutable"
+            if v == record["geometry_hash"]
+            else "public, no-cache"
+        ),
+    }
+
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
 
-    gdf = gpd.GeoDataFrame({"geometry": [wkb]})
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-    gdf.plot(ax=ax, color="white", linewidth=2)
-    fig.axes[0].set_axis_off()
+    key = svg_key(record["user_id"], slug, record["geometry_hash"])
+    svg = memory_cache.get(key)
 
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png", bbox_inches="tight", pad_inches=0, transparent=True)
-    plt.close(fig)
+    if svg is None:
+        track = await fetch_track_svg(con, record["user_id"], slug)
+
+        if track is None:
+            return not_found_resp(request)
 
-    buf.seek(0)
-    return StreamingResponse(buf, media_type="image/png")
+        svg = render_svg(track["path"], track["width"], track["height"])
+        memory_cache.put(key, svg)
+
+    return Response(svg, media_type="image/svg+xml", headers=headers)
 
 
 @router.get("/lon/{username}/{slug}")
@@ -95,24 +223,24 @@ async def display_tracks(
     request: Request,
     username: str,
     slug: str,
-    con: Connection = Depends(get_connection_from_pool),
 ):
-    record = await con.fetchrow(
-        """
-        SELECT
-            slug, name, activity, username
-        FROM tracks
-        JOIN users ON tracks.user_id = users.id
-        WHERE users.username = $1 AND tracks.slug = $2
-        """,
-        username,
-        slug,
-    )
+    key = page_key(request)
+    cached = cached_page(request, key)
+
+    if cached is not None:
+        return cached
+
+    since = data_version()
+
+    async with acquire_connection() as con:
+        record = await fetch_track_details(con, username, slug)
 
     if record is None:
         return not_found_resp(request)
 
-    return templates.TemplateResponse(
+    return render_page(
+        request,
+        key,
         "track.html",
         {
             "request": request,
@@ -120,7 +248,15 @@ async def display_tracks(
             "name": record["name"],
             "activity_emoji": activity_to_emoji(record["activity"]),
             "username": record["username"],
+            "geometry_hash": record["geometry_hash"],
+            "distance": record["distance"],
+            "points": record["points"],
+            "duration": record["duration"],
+            "elevation_gain": record["elevation_gain"],
+            "started_at": record["started_at"],
         },
+        record["user_id"],
+        since,
     )
 
 
@@ -139,14 +275,7 @@ async def track_actions(
 
     match method:
         case "DELETE":
-            await con.execute(
-                """
-                DELETE FROM tracks
-                WHERE slug = $1 AND user_id = $2
-                """,
-                slug,
-                user["id"],
-            )
+            await delete_track(con, user["id"], slug)
 
             # TODO this should contain a flash message
 
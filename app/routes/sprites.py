@@ -0,0 +1,71 @@
+from typing import List
+
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import Response, PlainTextResponse
+from asyncpg import Connection
+
+from app.db import get_connection_from_pool
+from app.fastapi_utils import etag_matches
+from app.render_pool import render_sprite, RenderQueueFull
+from app.settings import settings
+from app.sprites import (
+    SPRITE_CELL_SIZE,
+    sprite_cache,
+    sprite_key,
+    parse_sprite_track,
+    fetch_geometry_hashes,
+    fetch_sprite_geometries,
+)
+
+router = APIRouter()
+
+
+@router.get("/lon/sprite.png")
+async def sprite_route(
+    request: Request,
+    t: List[str] = Query(default=[]),
+    con: Connection = Depends(get_connection_from_pool),
+):
+    try:
+        tracks = [parse_sprite_track(value) for value in t]
+    except ValueError:
+        return PlainTextResponse("Invalid track", status_code=400)
+
+    if not tracks or len(tracks) > settings.page_size:
+        return PlainTextResponse(
+            f"Between 1 and {settings.page_size} tracks", status_code=400
+        )
+
+    current_hashes = await fetch_geometry_hashes(con, tracks)
+    current = [
+        (user_id, geometry_hash, slug)
+        for (user_id, _, slug), geometry_hash in zip(tracks, current_hashes)
+    ]
+
+    key = sprite_key(current)
+
+    # the url names the geometry of every track in it, while those are still
+    # current the sprite behind it can't change
+    headers = {
+        "ETag": f'"{key}"',
+        "Cache-Control": (
+            "public, max-age=31536000, immutable" if current == tracks else "no-cache"
+        ),
+    }
+
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    png = sprite_cache.get(key)
+
+    if png is None:
+        wkbs = await fetch_sprite_geometries(con, tracks)
+
+        try:
+            png = await render_sprite(("sprite", key), wkbs, SPRITE_CELL_SIZE)
+        except RenderQueueFull:
+            return Response(status_code=503, headers={"Retry-After": "1"})
+
+        sprite_cache.put(key, png)
+
+    return Response(png, media_type="image/png", headers=headers)
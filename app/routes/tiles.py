@@ -0,0 +1,60 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import Response
+from asyncpg import Connection
+
+from app.db import acquire_connection, get_connection_from_pool
+from app.heatmap import fetch_heatmap_counts, fetch_heatmap_version, heatmap_cache
+from app.render_pool import render_heatmap, RenderQueueFull
+from app.settings import settings
+from app.tiles import get_tile
+
+router = APIRouter()
+
+
+@router.get("/lon/tiles/{z}/{x}/{y}.mvt")
+async def tile_route(
+    z: int,
+    x: int,
+    y: int,
+    con: Connection = Depends(get_connection_from_pool),
+):
+    if z < 0 or z > 22 or not (0 <= x < 2**z and 0 <= y < 2**z):
+        return Response(status_code=404)
+
+    tile = await get_tile(con, z, x, y)
+
+    return Response(
+        tile,
+        media_type="application/vnd.mapbox-vector-tile",
+        headers={"Cache-Control": "public, max-age=60"},
+    )
+
+
+@router.get("/lon/heatmap/{z}/{x}/{y}.png")
+async def heatmap_route(z: int, x: int, y: int):
+    # deeper zooms are drawn by the map scaling up tiles from the last one
+    if z < 0 or z > settings.heatmap_max_zoom or not (0 <= x < 2**z and 0 <= y < 2**z):
+        return Response(status_code=404)
+
+    async with acquire_connection() as con:
+        version = await fetch_heatmap_version(con, z, x, y)
+        png = heatmap_cache.get((z, x, y, version))
+
+        if png is None:
+            version, counts = await fetch_heatmap_counts(con, z, x, y)
+
+    if png is None:
+        key = (z, x, y, version)
+
+        try:
+            png = await render_heatmap(("heatmap", *key), counts)
+        except RenderQueueFull:
+            return Response(status_code=503, headers={"Retry-After": "1"})
+
+        heatmap_cache.put(key, png)
+
+    return Response(
+        png,
+        media_type="image/png",
+        headers={"Cache-Control": "public, max-age=60"},
+    )
@@ -1,11 +1,15 @@
+from typing import List
+
 from fastapi import Request, Depends, UploadFile, APIRouter
 from fastapi.responses import RedirectResponse
-import geopandas as gpd
 from asyncpg import Connection
 from loguru import logger
 
-from app.db import get_connection_from_pool
-from app.fastapi_utils import templates
+from app.batch import BatchError, insert_batch, prepare_batch
+from app.db import get_connection_from_pool, get_pool
+from app.fastapi_utils import templates, not_found_resp, wants_fragment
+from app.ingest import enqueue_ingest_job, fetch_ingest_job
+from app.settings import settings
 
 router = APIRouter()
 
@@ -24,14 +28,6 @@ async def upload_gpx_page_route(request: Request):
     )
 
 
-def slugify_name(name: str):
-    name = name.encode("ascii", "ignore").decode("utf-8")
-    name = name.lower()
-    name = " ".join(name.split())
-    name = name.replace(" ", "-")
-    return name
-
-
 @router.post("/lon/upload")
 async def upload_gpx_route(
     request: Request,
@@ -43,50 +39,95 @@ async def upload_gpx_route(
     if user is None:
         return RedirectResponse("/lon/login", status_code=303)
 
-    number_of_tracks_for_user = await con.fetchval(
-        "SELECT COUNT(*) FROM tracks WHERE user_id = $1",
-        user["id"],
-    )
+    # the body has already been received, so reading it before the quota is
+    # checked costs nothing and lets the check and insert be one statement
+    data = await gpx.read(settings.gpx_max_bytes + 1)
 
-    if number_of_tracks_for_user is None or number_of_tracks_for_user >= 50:
+    if len(data) > settings.gpx_max_bytes:
+        # TODO this should be a flash message instead
+        return "GPX file is too large"
+
+    job = await enqueue_ingest_job(con, user["id"], gpx.filename, data)
+
+    if job is None:
         # TODO this should be a flash message instead
         return "You have reached the maximum number of tracks, poke Jack"
 
-    row = gpd.read_file(gpx.file, layer="tracks", driver="GPX").iloc[0]
-    name = row["name"] or gpx.filename
+    logger.info(f"Queued ingest job {job['id']} for {gpx.filename}")
+
+    return templates.TemplateResponse(
+        "upload_status.html",
+        {
+            "request": request,
+            "job": job,
+        },
+        status_code=202,
+        headers={"HX-Push-Url": f"/lon/upload/{job['id']}"},
+    )
 
-    if name.lower().endswith(".gpx"):
-        name = name[:-4]
 
-    geometry = row["geometry"].wkt
-    activity = row["type"] or "walking"
-    user_id = user["id"]
-    slug = slugify_name(name)
+@router.get("/lon/upload/{job_id}")
+async def upload_status_route(
+    request: Request,
+    job_id: int,
+    con: Connection = Depends(get_connection_from_pool),
+):
+    user = request.session.get("user")
 
-    errors = []
+    if user is None:
+        return RedirectResponse("/lon/login", status_code=303)
 
-    if len(name) < 3 or len(name) > 100:
-        errors.append("Name must be between 3 and 100 characters")
+    job = await fetch_ingest_job(con, job_id)
 
-    if len(activity) > 20:
-        errors.append("Activity must be at most 20 characters")
+    if job is None or job["user_id"] != user["id"]:
+        return not_found_resp(request)
 
-    if len(errors) > 0:
-        # TODO this should be a flash message instead
-        return ", ".join(errors)
-
-    await con.fetchval(
-        """
-        INSERT INTO tracks (name, slug, geometry, activity, user_id)
-        VALUES ($1, $2, ST_SetSRID(ST_GeomFromText($3), 4326), $4, $5)
-        """,
-        name,
-        slug,
-        geometry,
-        activity,
-        user_id,
+    # htmx polls for just the status, a visit gets the whole page
+    return templates.TemplateResponse(
+        "upload_job.html" if wants_fragment(request) else "upload_status.html",
+        {
+            "request": request,
+            "job": job,
+        },
     )
 
-    logger.info(f"Inserted track {name}")
 
-    return RedirectResponse(f"/lon/{user['username']}/{slug}", status_code=303)
+@router.post("/lon/upload/batch")
+async def upload_batch_route(request: Request, files: List[UploadFile]):
+    user = request.session.get("user")
+
+    if user is None:
+        return RedirectResponse("/lon/login", status_code=303)
+
+    uploads = []
+    remaining = settings.batch_max_bytes
+
+    for file in files:
+        data = await file.read(remaining + 1)
+        remaining -= len(data)
+
+        if remaining < 0:
+            # TODO this should be a flash message instead
+            return "Batch is too large"
+
+        uploads.append((file.filename, data))
+
+    try:
+        items = await prepare_batch(uploads)
+    except BatchError as e:
+        # TODO this should be a flash message instead
+        return str(e)
+
+    # only take a connection once the parsing is done
+    pool = await get_pool()
+
+    async with pool.acquire() as con:
+        items = await insert_batch(con, user["id"], items)
+
+    return templates.TemplateResponse(
+        "upload_batch.html",
+        {
+            "request": request,
+            "items": items,
+        },
+    )
@@ -0,0 +1,91 @@
+import hashlib
+from typing import List, Optional, Tuple
+from urllib.parse import urlencode
+
+from asyncpg import Connection
+
+from app.cache import LRUCache
+from app.settings import settings
+from app.thumbnails import render_params
+
+# drawn at twice the size listings show them at, for high dpi screens
+SPRITE_CELL_SIZE = 200
+
+# (user id, geometry hash, slug)
+SpriteTrack = Tuple[int, Optional[str], str]
+
+sprite_cache: LRUCache[str] = LRUCache(settings.sprite_cache_max_bytes)
+
+
+def sprite_url(tracks: List[dict]) -> str:
+    query = urlencode(
+        [
+            ("t", f"{track['user_id']}:{track['geometry_hash']}:{track['slug']}")
+            for track in tracks
+        ]
+    )
+
+    return f"/lon/sprite.png?{query}"
+
+
+def parse_sprite_track(value: str) -> SpriteTrack:
+    user_id, geometry_hash, slug = value.split(":", 2)
+    return int(user_id), geometry_hash, slug
+
+
+def sprite_key(tracks: List[SpriteTrack]) -> str:
+    digest = hashlib.md5(f"{render_params()}-{SPRITE_CELL_SIZE}".encode())
+
+    for user_id, geometry_hash, slug in tracks:
+        digest.update(f"\n{user_id}:{geometry_hash}:{slug}".encode())
+
+    return digest.hexdigest()
+
+
+async def fetch_geometry_hashes(
+    con: Connection, tracks: List[SpriteTrack]
+) -> List[Optional[str]]:
+    records = await con.fetch(
+        """
+        SELECT tracks.geometry_hash
+        FROM unnest($1::int[], $2::text[]) WITH ORDINALITY
+            AS wanted (user_id, slug, position)
+        LEFT JOIN tracks
+            ON tracks.user_id = wanted.user_id AND tracks.slug = wanted.slug
+        ORDER BY wanted.position
+        """,
+        [user_id for user_id, _, _ in tracks],
+        [slug for _, _, slug in tracks],
+    )
+
+    return [record["geometry_hash"] for record in records]
+
+
+async def fetch_sprite_geometries(
+    con: Connection, tracks: List[SpriteTrack]
+) -> List[Optional[bytes]]:
+    # every track in one go, simplified to what is visible in a cell so big
+    # tracks don't send every point just to be drawn 200px wide
+    records = await con.fetch(
+        """
+        SELECT
+            ST_Simplify(
+                tracks.geometry,
+                GREATEST(
+                    ST_XMax(tracks.geometry) - ST_XMin(tracks.geometry),
+                    ST_YMax(tracks.geometry) - ST_YMin(tracks.geometry)
+                ) / $3 / 4,
+                true
+            ) AS geometry
+        FROM unnest($1::int[], $2::text[]) WITH ORDINALITY
+            AS wanted (user_id, slug, position)
+        LEFT JOIN tracks
+            ON tracks.user_id = wanted.user_id AND tracks.slug = wanted.slug
+        ORDER BY wanted.position
+        """,
+        [user_id for user_id, _, _ in tracks],
+        [slug for _, _, slug in tracks],
+        SPRITE_CELL_SIZE,
+    )
+
+    return [record["geometry"] for record in records]
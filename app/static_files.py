@@ -0,0 +1,150 @@
+import hashlib
+import mimetypes
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+
+from app.compression import SUFFIXES, available_encodings, compress, negotiate_encoding
+
+STATIC_DIR = Path("static")
+
+# text formats worth compressing, images and the like already are
+COMPRESSIBLE = {".css", ".html", ".js", ".json", ".map", ".mjs", ".svg", ".txt"}
+
+# a year, the longest caches are asked to keep anything
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# path -> (mtime, size, fingerprint), so a file is only hashed again when it
+# changes rather than every time a page links to it
+fingerprints: Dict[str, Tuple[int, int, str]] = {}
+
+
+def asset_fingerprint(path: str) -> Optional[str]:
+    try:
+        stat = os.stat(STATIC_DIR / path)
+    except OSError:
+        return None
+
+    cached = fingerprints.get(path)
+
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    fingerprint = hashlib.md5((STATIC_DIR / path).read_bytes()).hexdigest()[:12]
+    fingerprints[path] = (stat.st_mtime_ns, stat.st_size, fingerprint)
+
+    return fingerprint
+
+
+def static_url(path: str) -> str:
+    # the fingerprint changes with the file, so the url can be cached forever
+    fingerprint = asset_fingerprint(path)
+
+    if fingerprint is None:
+        return f"/static/{path}"
+
+    return f"/static/{path}?v={fingerprint}"
+
+
+def compressed_variant(path: str, encoding: str) -> str:
+    return f"{path}{SUFFIXES[encoding]}"
+
+
+def is_variant(path: Path) -> bool:
+    return path.suffix in SUFFIXES.values()
+
+
+def compress_static(directory: Path = STATIC_DIR) -> List[Tuple[Path, str, int, int]]:
+    results = []
+
+    for path in sorted(directory.rglob("*")):
+        if not path.is_file() or is_variant(path) or path.suffix not in COMPRESSIBLE:
+            continue
+
+        data = path.read_bytes()
+
+        for encoding in available_encodings():
+            compressed = compress(data, encoding, best=True)
+
+            # not worth a second file, or the overhead of decoding it
+            if len(compressed) >= len(data):
+                continue
+
+            Path(compressed_variant(str(path), encoding)).write_bytes(compressed)
+            results.append((path, encoding, len(data), len(compressed)))
+
+    return results
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    # serves the .br/.gz files compress_static leaves next to an asset to
+    # clients that accept them, and marks fingerprinted urls immutable
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope,
+        status_code: int = 200,
+    ):
+        request_headers = Headers(scope=scope)
+        path = self.get_path(scope)
+
+        media_type = mimetypes.guess_type(str(full_path))[0] or "text/plain"
+        encoding = None
+
+        if Path(full_path).suffix in COMPRESSIBLE:
+            encoding = negotiate_encoding(
+                request_headers.get("accept-encoding"),
+                [
+                    encoding
+                    for encoding in available_encodings()
+                    if self.fresh_variant(full_path, stat_result, encoding)
+                ],
+            )
+
+        if encoding is not None:
+            full_path = compressed_variant(str(full_path), encoding)
+            stat_result = os.stat(full_path)
+
+        response = FileResponse(
+            full_path,
+            status_code=status_code,
+            stat_result=stat_result,
+            media_type=media_type,
+        )
+
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+
+        if Path(path).suffix in COMPRESSIBLE:
+            response.headers["Vary"] = "Accept-Encoding"
+
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        fingerprint = query.get("v", [None])[0]
+
+        if fingerprint is not None and fingerprint == asset_fingerprint(path):
+            response.headers["Cache-Control"] = IMMUTABLE
+        else:
+            response.headers["Cache-Control"] = "public, no-cache"
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+
+        return response
+
+    def fresh_variant(
+        self, full_path, stat_result: os.stat_result, encoding: str
+    ) -> bool:
+        # a variant older than its file was left behind by an earlier build
+        try:
+            variant = os.stat(compressed_variant(str(full_path), encoding))
+        except OSError:
+            return False
+
+        return variant.st_mtime_ns >= stat_result.st_mtime_ns
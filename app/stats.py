@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from asyncpg import Connection
+
+# (slug, started_at, finished_at, elevation_gain)
+TrackTimes = Tuple[str, Optional[datetime], Optional[datetime], Optional[float]]
+
+# selected alongside tracks in listings, in place of loading the geometry
+STATS_COLUMNS = """
+    track_stats.distance,
+    track_stats.duration,
+    track_stats.elevation_gain,
+    track_stats.started_at,
+    track_stats.minx,
+    track_stats.miny,
+    track_stats.maxx,
+    track_stats.maxy
+"""
+
+
+async def store_track_stats(con: Connection, user_id: int, tracks: List[TrackTimes]):
+    # everything that can be read off the stored geometry is worked out here,
+    # only what the simplified geometry has lost comes from the gpx
+    await con.execute(
+        """
+        INSERT INTO track_stats (
+            user_id, slug, distance, points, minx, miny, maxx, maxy,
+            start_point, end_point, started_at, finished_at, elevation_gain
+        )
+        SELECT
+            tracks.user_id,
+            tracks.slug,
+            ST_Length(tracks.geometry::geography),
+            ST_NPoints(tracks.geometry),
+            ST_XMin(tracks.geometry),
+            ST_YMin(tracks.geometry),
+            ST_XMax(tracks.geometry),
+            ST_YMax(tracks.geometry),
+            ST_StartPoint(ST_GeometryN(tracks.geometry, 1)),
+            ST_EndPoint(
+                ST_GeometryN(tracks.geometry, ST_NumGeometries(tracks.geometry))
+            ),
+            times.started_at,
+            times.finished_at,
+            times.elevation_gain
+        FROM tracks
+        JOIN unnest($2::text[], $3::timestamp[], $4::timestamp[], $5::float8[])
+            AS times (slug, started_at, finished_at, elevation_gain)
+            ON tracks.slug = times.slug
+        WHERE tracks.user_id = $1
+        ON CONFLICT (user_id, slug) DO UPDATE SET
+            distance = EXCLUDED.distance,
+            points = EXCLUDED.points,
+            minx = EXCLUDED.minx,
+            miny = EXCLUDED.miny,
+            maxx = EXCLUDED.maxx,
+            maxy = EXCLUDED.maxy,
+            start_point = EXCLUDED.start_point,
+            end_point = EXCLUDED.end_point,
+            started_at = EXCLUDED.started_at,
+            finished_at = EXCLUDED.finished_at,
+            elevation_gain = EXCLUDED.elevation_gain
+        """,
+        user_id,
+        *(list(column) for column in zip(*tracks)),
+    )
+
+
+def format_distance(metres: Optional[float]) -> str:
+    if metres is None:
+        return ""
+
+    if metres < 1000:
+        return f"{metres:.0f} m"
+
+    return f"{metres / 1000:.1f} km"
+
+
+def format_duration(duration: Optional[timedelta]) -> str:
+    if duration is None:
+        return ""
+
+    minutes, seconds = divmod(int(duration.total_seconds()), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return f"{hours}:{minutes:02}:{seconds:02}"
+
+
+def format_elevation(metres: Optional[float]) -> str:
+    if metres is None:
+        return ""
+
+    return f"↑ {metres:.0f} m"
@@ -0,0 +1,80 @@
+from typing import Optional
+
+from asyncpg import Connection, Record
+
+
+# tracks are scaled so their longer side spans this many units, with whole
+# numbers that's finer than a pixel at any size they're shown at
+SVG_SIZE = 4096
+
+# in units, anything smaller than this isn't visible
+SVG_TOLERANCE = 2.0
+
+# room around the track so the stroke isn't clipped
+SVG_PADDING = 0.01 * SVG_SIZE
+
+SVG_PARAMS = f"svg-{SVG_SIZE}-{SVG_TOLERANCE}"
+
+
+# keys live alongside thumbnail keys in the thumbnail memory cache, so
+# invalidating a track's thumbnails drops its svg as well
+def svg_key(user_id: int, slug: str, geometry_hash: str):
+    return (user_id, slug, geometry_hash, SVG_PARAMS)
+
+
+def svg_etag(geometry_hash: str) -> str:
+    return f'"{geometry_hash}-{SVG_PARAMS}"'
+
+
+async def fetch_track_svg(con: Connection, user_id: int, slug: str) -> Optional[Record]:
+    # normalize to a SVG_SIZE box with the corner at the origin, then
+    # simplify in those units, ST_AsSVG flips y so the box ends up above it
+    return await con.fetchrow(
+        """
+        WITH track AS (
+            SELECT
+                geometry,
+                ST_XMin(geometry) AS minx,
+                ST_YMin(geometry) AS miny,
+                $3::float8 / GREATEST(
+                    ST_XMax(geometry) - ST_XMin(geometry),
+                    ST_YMax(geometry) - ST_YMin(geometry),
+                    1e-9
+                ) AS scale
+            FROM tracks
+            WHERE user_id = $1 AND slug = $2
+        ), normalized AS (
+            SELECT
+                ST_Simplify(
+                    ST_Scale(ST_Translate(geometry, -minx, -miny), scale, scale),
+                    $4::float8,
+                    true
+                ) AS geometry
+            FROM track
+        )
+        SELECT
+            ST_AsSVG(geometry, 0, 0) AS path,
+            ST_XMax(geometry) AS width,
+            ST_YMax(geometry) AS height
+        FROM normalized
+        """,
+        user_id,
+        slug,
+        SVG_SIZE,
+        SVG_TOLERANCE,
+    )
+
+
+def render_svg(path: str, width: float, height: float) -> bytes:
+    padding = SVG_PADDING
+    view_box = (
+        f"{-padding:g} {-height - padding:g} "
+        f"{width + 2 * padding:g} {height + 2 * padding:g}"
+    )
+
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="{view_box}">'
+        f'<path d="{path}" fill="none" stroke="white" stroke-width="2" '
+        'stroke-linecap="round" stroke-linejoin="round" '
+        'vector-effect="non-scaling-stroke"/></svg>'
+    ).encode()
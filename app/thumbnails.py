@@ -0,0 +1,82 @@
+from functools import cache
+from typing import Optional, Tuple
+
+from asyncpg import Connection
+
+from app.cache import LRUCache
+from app.settings import settings
+
+ThumbnailKey = Tuple[int, str, str, str]
+
+memory_cache: LRUCache[ThumbnailKey] = LRUCache(settings.thumbnail_cache_max_bytes)
+
+
+@cache
+def render_params() -> str:
+    # the rasterizer pulls in numpy and shapely, only load them once needed
+    from app.rasterizer import RENDER_SIZE, STROKE_WIDTH
+
+    return f"raster-{RENDER_SIZE}-{STROKE_WIDTH}"
+
+
+def thumbnail_key(user_id: int, slug: str, geometry_hash: str) -> ThumbnailKey:
+    return (user_id, slug, geometry_hash, render_params())
+
+
+def thumbnail_etag(geometry_hash: str) -> str:
+    return f'"{geometry_hash}-{render_params()}"'
+
+
+async def get_thumbnail(con: Connection, key: ThumbnailKey) -> Optional[bytes]:
+    png = memory_cache.get(key)
+
+    if png is not None:
+        return png
+
+    png = await con.fetchval(
+        """
+        SELECT png FROM thumbnails
+        WHERE user_id = $1 AND slug = $2 AND geometry_hash = $3 AND params = $4
+        """,
+        *key,
+    )
+
+    if png is not None:
+        memory_cache.put(key, png)
+
+    return png
+
+
+async def store_thumbnail(con: Connection, key: ThumbnailKey, png: bytes):
+    memory_cache.put(key, png)
+
+    # only store it if the track still has the geometry we rendered,
+    # it may have been deleted or re-uploaded while we were rendering
+    await con.execute(
+        """
+        INSERT INTO thumbnails (user_id, slug, geometry_hash, params, png)
+        SELECT $1, $2, $3, $4, $5
+        WHERE EXISTS (
+            SELECT 1 FROM tracks
+            WHERE user_id = $1 AND slug = $2 AND geometry_hash = $3
+        )
+        ON CONFLICT DO NOTHING
+        """,
+        *key,
+        png,
+    )
+
+
+async def invalidate_thumbnails(con: Connection, user_id: int, slug: str):
+    memory_cache.drop(lambda key: key[:2] == (user_id, slug))
+
+    await con.execute(
+        """
+        DELETE FROM thumbnails
+        WHERE user_id = $1 AND slug = $2 AND geometry_hash IS DISTINCT FROM (
+            SELECT geometry_hash FROM tracks WHERE user_id = $1 AND slug = $2
+        )
+        """,
+        user_id,
+        slug,
+    )
@@ -0,0 +1,68 @@
+from typing import Tuple
+
+from asyncpg import Connection
+
+from app.cache import LRUCache
+from app.lod import lod_tier, lod_column
+from app.settings import settings
+from app.versions import data_version
+
+TileKey = Tuple[int, int, int]
+
+# ST_AsMVTGeom defaults, extent of 4096 with a 256 buffer around each tile
+TILE_EXTENT = 4096
+TILE_BUFFER = 256
+
+# keyed on the data version as well, which moves on with every write to
+# tracks from any process, so tiles never need clearing
+tile_cache: LRUCache[Tuple[int, int, int, int]] = LRUCache(
+    settings.tile_cache_max_bytes
+)
+
+
+async def get_tile(con: Connection, z: int, x: int, y: int) -> bytes:
+    # read before the query, so a write landing during it leaves this entry
+    # under a version that's already stale
+    key = (z, x, y, data_version())
+    tile = tile_cache.get(key)
+
+    if tile is not None:
+        return tile
+
+    tile = await con.fetchval(
+        f"""
+        WITH
+            bounds AS (
+                SELECT ST_TileEnvelope($1, $2, $3) AS envelope
+            ),
+            features AS (
+                SELECT
+                    ST_AsMVTGeom(
+                        ST_Transform(tracks.{lod_column(lod_tier(z))}, 3857),
+                        bounds.envelope,
+                        {TILE_EXTENT},
+                        {TILE_BUFFER}
+                    ) AS geom,
+                    tracks.slug,
+                    tracks.name,
+                    tracks.activity,
+                    users.username
+                FROM
+                    tracks
+                JOIN
+                    users ON tracks.user_id = users.id,
+                    bounds
+                WHERE
+                    tracks.geometry && ST_Transform(bounds.envelope, 4326)
+            )
+        SELECT ST_AsMVT(features, 'tracks') FROM features
+        """,
+        z,
+        x,
+        y,
+    )
+
+    tile = tile or b""
+    tile_cache.put(key, tile)
+
+    return tile
@@ -0,0 +1,95 @@
+import asyncio
+from typing import Optional, Dict
+
+import asyncpg
+from loguru import logger
+
+from app.db import get_connection
+
+# every write to tracks bumps a counter, caches key their entries on the
+# version they were built from so they never need to be cleared explicitly.
+# other processes find out through the tracks_changed trigger.
+counter = 0
+epoch = 0
+user_versions: Dict[int, int] = {}
+
+listener: Optional[asyncpg.Connection] = None
+
+CHANNEL = "tracks_changed"
+RECONNECT_DELAY = 5
+
+
+def data_version(user_id: Optional[int] = None) -> int:
+    if user_id is None:
+        return counter
+
+    return max(user_versions.get(user_id, 0), epoch)
+
+
+def bump_data_version(user_id: int) -> None:
+    global counter
+
+    counter += 1
+    user_versions[user_id] = counter
+
+
+def bump_all_data_versions() -> None:
+    global counter, epoch
+
+    counter += 1
+    epoch = counter
+
+
+def on_tracks_changed(connection, pid, channel, payload):
+    bump_data_version(int(payload))
+
+
+def on_listener_terminated(connection):
+    global listener
+
+    logger.warning("Lost tracks_changed listener, reconnecting")
+
+    listener = None
+    # we may have missed notifications while disconnected
+    bump_all_data_versions()
+    asyncio.get_running_loop().create_task(reconnect_listener())
+
+
+async def reconnect_listener():
+    while listener is None:
+        await asyncio.sleep(RECONNECT_DELAY)
+
+        try:
+            await start_listener()
+        except (OSError, asyncpg.PostgresError) as e:
+            logger.warning(f"Failed to reconnect tracks_changed listener: {e}")
+
+    bump_all_data_versions()
+
+
+async def start_listener() -> asyncpg.Connection:
+    global listener
+
+    if listener is not None:
+        logger.warning("Attempt to start listener when listener already exists")
+        return listener
+
+    connection = await get_connection()
+    await connection.add_listener(CHANNEL, on_tracks_changed)
+    connection.add_termination_listener(on_listener_terminated)
+
+    listener = connection
+    return listener
+
+
+async def stop_listener() -> None:
+    global listener
+
+    if listener is None:
+        raise Exception("Attempt to stop listener with no listener")
+
+    connection = listener
+    listener = None
+
+    connection.remove_termination_listener(on_listener_terminated)
+    await connection.close()
@@ -0,0 +1,45 @@
+// node bench/decode.mjs bench_output/transport/results.json
+//
+// times decoding the payloads written by bench/transport.py the way
+// static/tracks-lat.js does it
+import { readFileSync } from "node:fs";
+import { decodePolylines } from "../static/polyline.js";
+
+const REPEAT = 20;
+
+const decode = (format, text, precision) => {
+  const features = text
+    .split("\n")
+    .filter((line) => line)
+    .map((line) => JSON.parse(line));
+
+  if (format === "polyline") {
+    return features.map((feature) =>
+      decodePolylines(feature.polylines, precision)
+    );
+  }
+
+  return features.map((feature) => feature.geometry.coordinates);
+};
+
+const results = JSON.parse(readFileSync(process.argv[2], "utf-8")).map(
+  (result) => {
+    const text = readFileSync(result.path, "utf-8");
+    const timings = [];
+
+    for (let i = 0; i < REPEAT; i++) {
+      const start = performance.now();
+      decode(result.format, text, result.precision);
+      timings.push(performance.now() - start);
+    }
+
+    timings.sort((a, b) => a - b);
+
+    return {
+      ...result,
+      decode_p50_ms: timings[Math.floor(timings.length / 2)],
+    };
+  }
+);
+
+console.log(JSON.stringify(results, null, 2));
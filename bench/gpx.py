@@ -0,0 +1,109 @@
+import importlib
+import io
+import json
+import multiprocessing
+import resource
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import typer
+
+app = typer.Typer()
+
+
+def synthetic_gpx(points: int, segments: int = 1, seed: int = 0) -> bytes:
+    rng = np.random.default_rng(seed)
+
+    heading = np.cumsum(rng.normal(scale=0.05, size=points))
+    steps = np.column_stack([np.cos(heading), np.sin(heading)]) * 0.000015
+    coords = np.cumsum(steps, axis=0) + (-52.7, 47.56)
+    elevations = 50 + np.cumsum(rng.normal(scale=0.2, size=points))
+    start = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<gpx version="1.1" creator="bench" xmlns="http://www.topografix.com/GPX/1/1">',
+        "<trk><name>bench track</name><type>walking</type>",
+    ]
+
+    for part in np.array_split(np.arange(points), segments):
+        lines.append("<trkseg>")
+        for i in part:
+            time = (
+                (start + timedelta(seconds=int(i))).isoformat().replace("+00:00", "Z")
+            )
+            lines.append(
+                f'<trkpt lat="{coords[i, 1]:.7f}" lon="{coords[i, 0]:.7f}">'
+                f"<ele>{elevations[i]:.1f}</ele><time>{time}</time></trkpt>"
+            )
+        lines.append("</trkseg>")
+
+    lines.append("</trk></gpx>")
+
+    return "\n".join(lines).encode()
+
+
+def parse_streaming(data: bytes) -> int:
+    from app.gpx import parse_gpx
+
+    return len(parse_gpx(io.BytesIO(data), max_bytes=len(data)).to_wkb())
+
+
+def parse_geopandas(data: bytes) -> int:
+    import geopandas as gpd
+
+    row = gpd.read_file(io.BytesIO(data), layer="tracks", driver="GPX").iloc[0]
+    return len(row["geometry"].wkt)
+
+
+PARSERS = {
+    "streaming": ("app.gpx", parse_streaming),
+    "geopandas": ("geopandas", parse_geopandas),
+}
+
+
+def measure(parser: str, data: bytes) -> dict:
+    # runs in a fresh process so max rss only reflects this parser
+    module, parse = PARSERS[parser]
+
+    start = time.perf_counter()
+    importlib.import_module(module)
+    import_seconds = time.perf_counter() - start
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    parse(data)
+    seconds = time.perf_counter() - start
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return {
+        "import_seconds": import_seconds,
+        "seconds": seconds,
+        "peak_rss_growth_mb": (peak_kb - baseline_kb) / 1024,
+    }
+
+
+@app.command()
+def main(points: list[int] = typer.Option([10_000, 100_000, 500_000])):
+    context = multiprocessing.get_context("spawn")
+    results = []
+
+    for count in points:
+        data = synthetic_gpx(count, segments=2)
+
+        for parser in PARSERS:
+            with context.Pool(1) as pool:
+                result = pool.apply(measure, (parser, data))
+
+            results.append(
+                {"points": count, "bytes": len(data), "parser": parser} | result
+            )
+
+    typer.echo(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,413 @@
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional
+
+import asyncpg
+import bcrypt
+import numpy as np
+import shapely
+import typer
+
+from app.db import init_connection
+from app.heatmap import track_deltas, update_heatmap
+from app.ingest import delete_track
+from app.render_pool import start_render_pool, stop_render_pool
+from app.settings import settings
+from app.stats import store_track_stats
+from bench.gpx import synthetic_gpx
+from bench.render import synthetic_track_wkb
+
+app = typer.Typer(
+    help="Seed a database with synthetic tracks and load test a running server. "
+    "Works against the db service in docker-compose.yml, which is what "
+    "TRACKSLAT_PG_DSN points at by default, or any local PostGIS."
+)
+
+USER_PREFIX = "bench-"
+UPLOADER = f"{USER_PREFIX}uploader"
+PASSWORD = "bench-password"
+ACTIVITIES = ["walking", "running", "cycling", "hiking"]
+
+DEFAULT_MANIFEST = Path("bench_output/load/manifest.json")
+
+
+def seeded_track(points: int, seed: int) -> bytes:
+    # spread over about a degree so tiles and bbox queries see a realistic mix
+    # instead of every track stacked in the same spot
+    rng = np.random.default_rng(seed)
+    offset = rng.uniform(-0.5, 0.5, size=2)
+
+    geometry = shapely.from_wkb(synthetic_track_wkb(points, segments=2, seed=seed))
+    geometry = shapely.transform(geometry, lambda coords: coords + offset)
+
+    return shapely.to_wkb(shapely.set_srid(geometry, 4326), include_srid=True)
+
+
+def track_points(rng: np.random.Generator, min_points: int, max_points: int) -> int:
+    # log uniform, most tracks are short and a few are very long
+    return int(np.exp(rng.uniform(np.log(min_points), np.log(max_points))))
+
+
+async def connect(dsn: Optional[str]) -> asyncpg.Connection:
+    con = await asyncpg.connect(dsn or settings.pg_dsn)
+    await init_connection(con)
+    return con
+
+
+async def delete_bench_users(con: asyncpg.Connection):
+    # tracks are deleted the way the app does it so they come off the
+    # heatmap, stats, thumbnails and jobs go with the users through cascades
+    tracks = await con.fetch(
+        """
+        SELECT tracks.user_id, tracks.slug
+        FROM tracks
+        JOIN users ON tracks.user_id = users.id
+        WHERE users.username LIKE $1
+        """,
+        f"{USER_PREFIX}%",
+    )
+
+    for track in tracks:
+        await delete_track(con, track["user_id"], track["slug"])
+
+    await con.execute("DELETE FROM users WHERE username LIKE $1", f"{USER_PREFIX}%")
+
+
+async def create_bench_user(con: asyncpg.Connection, username: str, hash: bytes):
+    return await con.fetchval(
+        """
+        INSERT INTO users (username, email, password_hash, role)
+        VALUES ($1, $2, $3, 'user')
+        RETURNING id
+        """,
+        username,
+        f"{username}@bench.invalid",
+        hash,
+    )
+
+
+@app.command()
+def seed(
+    tracks: int = 1_000,
+    tracks_per_user: int = 50,
+    min_points: int = 1_000,
+    max_points: int = 10_000,
+    seed: int = 0,
+    workers: Optional[int] = None,
+    dsn: Optional[str] = None,
+    manifest: Path = DEFAULT_MANIFEST,
+):
+    """
+    Replace any earlier bench users with new ones owning TRACKS tracks
+    between MIN_POINTS and MAX_POINTS points each, counted into the heatmap
+    on WORKERS processes. The users and slugs are written to MANIFEST for
+    the run command.
+    """
+
+    async def run():
+        rng = np.random.default_rng(seed)
+        # the cost that matters is the server's check, not this one
+        hash = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(rounds=4))
+
+        start_render_pool(workers or os.cpu_count())
+        con = await connect(dsn)
+        start = time.perf_counter()
+
+        try:
+            await delete_bench_users(con)
+            await create_bench_user(con, UPLOADER, hash)
+
+            users = []
+            total_points = 0
+
+            for first in range(0, tracks, tracks_per_user):
+                username = f"{USER_PREFIX}{len(users):05}"
+                count = min(tracks_per_user, tracks - first)
+
+                geometries = []
+
+                for index in range(first, first + count):
+                    points = track_points(rng, min_points, max_points)
+                    total_points += points
+                    geometries.append(seeded_track(points, seed * 1_000_003 + index))
+
+                # binned before the transaction, as the app's own writes are
+                deltas = await asyncio.gather(
+                    *[track_deltas([wkb], []) for wkb in geometries]
+                )
+
+                async with con.transaction():
+                    user_id = await create_bench_user(con, username, hash)
+
+                    records = [
+                        (
+                            f"Bench track {index}",
+                            f"bench-track-{index}",
+                            geometry,
+                            ACTIVITIES[index % len(ACTIVITIES)],
+                            user_id,
+                        )
+                        for index, geometry in zip(
+                            range(first, first + count), geometries
+                        )
+                    ]
+
+                    await con.copy_records_to_table(
+                        "tracks",
+                        records=records,
+                        columns=["name", "slug", "geometry", "activity", "user_id"],
+                    )
+
+                    await store_track_stats(
+                        con,
+                        user_id,
+                        [(slug, None, None, None) for _, slug, _, _, _ in records],
+                    )
+
+                    # copied in rather than ingested, so counted in here
+                    await update_heatmap(con, list(deltas))
+
+                users.append(
+                    {
+                        "username": username,
+                        "slugs": [slug for _, slug, _, _, _ in records],
+                    }
+                )
+
+                typer.echo(f"seeded {first + count}/{tracks} tracks", err=True)
+        finally:
+            await con.close()
+            stop_render_pool()
+
+        manifest.parent.mkdir(parents=True, exist_ok=True)
+        manifest.write_text(
+            json.dumps(
+                {
+                    "tracks": tracks,
+                    "points": total_points,
+                    "seed": seed,
+                    "uploader": UPLOADER,
+                    "password": PASSWORD,
+                    "users": users,
+                },
+                indent=2,
+            )
+        )
+
+        typer.echo(
+            json.dumps(
+                {
+                    "users": len(users),
+                    "tracks": tracks,
+                    "points": total_points,
+                    "seconds": time.perf_counter() - start,
+                },
+                indent=2,
+            )
+        )
+
+    asyncio.run(run())
+
+
+@app.command()
+def reset(workers: Optional[int] = None, dsn: Optional[str] = None):
+    """
+    Delete every bench user and everything they own, taking their tracks
+    off the heatmap on WORKERS processes.
+    """
+
+    async def run():
+        start_render_pool(workers or os.cpu_count())
+        con = await connect(dsn)
+
+        try:
+            await delete_bench_users(con)
+        finally:
+            await con.close()
+            stop_render_pool()
+
+    asyncio.run(run())
+
+
+def summarise(timings: List[float], statuses: Counter, sizes: int, seconds: float):
+    timings = sorted(timings)
+
+    def percentile(p: float) -> Optional[float]:
+        if not timings:
+            return None
+
+        return timings[min(len(timings) - 1, int(len(timings) * p))] * 1000
+
+    return {
+        "requests": len(timings),
+        "seconds": seconds,
+        "throughput_rps": len(timings) / seconds if seconds else None,
+        "p50_ms": percentile(0.5),
+        "p90_ms": percentile(0.9),
+        "p99_ms": percentile(0.99),
+        "max_ms": timings[-1] * 1000 if timings else None,
+        "mean_bytes": sizes / len(timings) if timings else None,
+        "statuses": {str(status): count for status, count in statuses.items()},
+    }
+
+
+async def load(
+    client,
+    make_request,
+    requests: int,
+    concurrency: int,
+    warmup: int,
+    expected_status: int,
+) -> dict:
+    for index in range(warmup):
+        await make_request(client, index)
+
+    timings = []
+    statuses = Counter()
+    sizes = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal sizes
+
+        for index in remaining:
+            start = time.perf_counter()
+
+            try:
+                response = await make_request(client, index)
+            except Exception as e:
+                statuses[type(e).__name__] += 1
+                continue
+
+            timings.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+            sizes += len(response.content)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    result = summarise(timings, statuses, sizes, time.perf_counter() - start)
+
+    result["errors"] = sum(
+        count for status, count in statuses.items() if status != expected_status
+    )
+
+    return result
+
+
+SCENARIOS = ["home", "home-json", "user", "png", "upload"]
+
+
+@app.command()
+def run(
+    base_url: str = "http://127.0.0.1:8000",
+    scenarios: List[str] = typer.Option(SCENARIOS),
+    requests: int = 500,
+    concurrency: List[int] = typer.Option([1, 10, 50]),
+    warmup: int = 10,
+    upload_points: int = 1_000,
+    manifest: Path = DEFAULT_MANIFEST,
+    output: Optional[Path] = None,
+):
+    """
+    Load test a server seeded with the seed command. Uploads are made as
+    the uploader user and count against its quota, so raise
+    TRACKSLAT_MAX_TRACKS_PER_USER on the server for long upload runs.
+    """
+    import httpx
+
+    data = json.loads(manifest.read_text())
+    tracks = [
+        (user["username"], slug) for user in data["users"] for slug in user["slugs"]
+    ]
+    users = [user["username"] for user in data["users"]]
+
+    # the same tracks in the same order every run, so runs compare
+    order = np.random.default_rng(0).permutation(len(tracks))
+
+    gpx = synthetic_gpx(upload_points)
+
+    async def home(client, index):
+        return await client.get("/lon/")
+
+    async def home_json(client, index):
+        return await client.get("/lon/", params={"format": "json"})
+
+    async def user(client, index):
+        return await client.get(f"/lon/{users[index % len(users)]}")
+
+    async def png(client, index):
+        username, slug = tracks[order[index % len(tracks)]]
+        return await client.get(f"/lon/{username}/{slug}.png")
+
+    async def upload(client, index):
+        # the same name every time, so each upload replaces the last track
+        return await client.post(
+            "/lon/upload", files={"gpx": ("bench-upload.gpx", gpx)}
+        )
+
+    requests_for = {
+        "home": (home, 200),
+        "home-json": (home_json, 200),
+        "user": (user, 200),
+        "png": (png, 200),
+        "upload": (upload, 202),
+    }
+
+    for scenario in scenarios:
+        if scenario not in requests_for:
+            raise typer.BadParameter(f"Unknown scenario {scenario}")
+
+    async def main():
+        results = []
+
+        limits = httpx.Limits(max_connections=max(concurrency))
+        timeout = httpx.Timeout(60.0)
+
+        async with httpx.AsyncClient(
+            base_url=base_url, limits=limits, timeout=timeout
+        ) as client:
+            await client.post(
+                "/lon/login",
+                data={"username": data["uploader"], "password": data["password"]},
+            )
+
+            for scenario in scenarios:
+                make_request, expected_status = requests_for[scenario]
+
+                for level in concurrency:
+                    result = await load(
+                        client, make_request, requests, level, warmup, expected_status
+                    )
+                    results.append(
+                        {"scenario": scenario, "concurrency": level} | result
+                    )
+
+                    typer.echo(
+                        f"{scenario} x{level}: {result['requests']} ok, "
+                        f"{result['errors']} errors, p50 {result['p50_ms']}ms",
+                        err=True,
+                    )
+
+        report = {
+            "base_url": base_url,
+            "tracks": data["tracks"],
+            "points": data["points"],
+            "requests": requests,
+            "results": results,
+        }
+
+        if output is not None:
+            output.parent.mkdir(parents=True, exist_ok=True)
+            output.write_text(json.dumps(report, indent=2))
+
+        typer.echo(json.dumps(report, indent=2))
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,103 @@
+import io
+import json
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import shapely
+import typer
+
+from app.rasterizer import render_track_png
+
+app = typer.Typer()
+
+
+def synthetic_track_wkb(points: int, segments: int = 1, seed: int = 0) -> bytes:
+    rng = np.random.default_rng(seed)
+
+    # a slowly wandering heading at ~1.5m per fix, which is roughly what a
+    # phone recording a walk looks like
+    heading = np.cumsum(rng.normal(scale=0.05, size=points))
+    steps = np.column_stack([np.cos(heading), np.sin(heading)]) * 0.000015
+    coords = np.cumsum(steps, axis=0) + (-52.7, 47.56)
+
+    lines = np.array_split(coords, segments)
+
+    return shapely.to_wkb(shapely.MultiLineString(lines))
+
+
+def render_track_png_matplotlib(wkb) -> bytes:
+    import geopandas as gpd
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    geometry = shapely.from_wkb(wkb)
+
+    gdf = gpd.GeoDataFrame({"geometry": [geometry]})
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    gdf.plot(ax=ax, color="white", linewidth=2)
+    fig.axes[0].set_axis_off()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight", pad_inches=0, transparent=True)
+    plt.close(fig)
+
+    return buf.getvalue()
+
+
+def time_render(render, wkb, repeat: int) -> dict:
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        png = render(wkb)
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+
+    return {
+        "min_ms": timings[0] * 1000,
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "bytes": len(png),
+    }
+
+
+@app.command()
+def main(
+    points: list[int] = typer.Option([1_000, 10_000, 100_000]),
+    repeat: int = 10,
+    output_dir: Optional[Path] = None,
+):
+    results = []
+
+    for count in points:
+        wkb = synthetic_track_wkb(count, segments=3)
+
+        numpy_result = time_render(render_track_png, wkb, repeat)
+        matplotlib_result = time_render(render_track_png_matplotlib, wkb, repeat)
+
+        results.append(
+            {
+                "points": count,
+                "numpy": numpy_result,
+                "matplotlib": matplotlib_result,
+                "speedup": matplotlib_result["p50_ms"] / numpy_result["p50_ms"],
+            }
+        )
+
+        if output_dir is not None:
+            output_dir.mkdir(parents=True, exist_ok=True)
+            (output_dir / f"{count}-numpy.png").write_bytes(render_track_png(wkb))
+            (output_dir / f"{count}-matplotlib.png").write_bytes(
+                render_track_png_matplotlib(wkb)
+            )
+
+    typer.echo(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    app()
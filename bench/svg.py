@@ -0,0 +1,118 @@
+import gzip
+import json
+import time
+from typing import Optional
+
+import numpy as np
+import shapely
+import typer
+
+from app.rasterizer import render_track_png
+from app.svg import SVG_SIZE, SVG_TOLERANCE, render_svg
+from bench.render import synthetic_track_wkb
+
+app = typer.Typer()
+
+
+def render_track_svg(wkb) -> bytes:
+    # what the .svg route has postgis do, so the two can be compared offline
+    geometry = shapely.from_wkb(wkb)
+    minx, miny, maxx, maxy = shapely.bounds(geometry)
+    scale = SVG_SIZE / max(maxx - minx, maxy - miny, 1e-9)
+
+    geometry = shapely.transform(
+        geometry, lambda coords: (coords - (minx, miny)) * scale
+    )
+    geometry = shapely.simplify(geometry, SVG_TOLERANCE, preserve_topology=False)
+
+    path = " ".join(
+        "M " + " L ".join(f"{x:.0f} {-y:.0f}" for x, y in shapely.get_coordinates(part))
+        for part in shapely.get_parts(geometry)
+    )
+
+    return render_svg(path, (maxx - minx) * scale, (maxy - miny) * scale)
+
+
+def time_call(fn, arg, repeat: int) -> dict:
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn(arg)
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+
+    return {
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p99_ms": timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000,
+        "bytes": len(body),
+        "gzip_bytes": len(gzip.compress(body)),
+    }
+
+
+def offline(points: list[int], repeat: int) -> list:
+    results = []
+
+    for count in points:
+        wkb = synthetic_track_wkb(count, segments=3)
+
+        results.append(
+            {
+                "points": count,
+                "png": time_call(render_track_png, wkb, repeat),
+                "svg": time_call(render_track_svg, wkb, repeat),
+            }
+        )
+
+    return results
+
+
+def live(base_url: str, track: str, repeat: int) -> list:
+    import httpx
+
+    results = []
+
+    with httpx.Client(base_url=base_url) as client:
+        for extension in ("png", "svg"):
+            url = f"/lon/{track}.{extension}"
+            timings = []
+
+            for _ in range(repeat):
+                start = time.perf_counter()
+                response = client.get(url, headers={"Accept-Encoding": "gzip"})
+                response.raise_for_status()
+                timings.append(time.perf_counter() - start)
+
+            timings.sort()
+
+            results.append(
+                {
+                    "url": url,
+                    "p50_ms": timings[len(timings) // 2] * 1000,
+                    "p99_ms": float(np.percentile(timings, 99)) * 1000,
+                    "bytes": len(response.content),
+                    "wire_bytes": response.num_bytes_downloaded,
+                }
+            )
+
+    return results
+
+
+@app.command()
+def main(
+    points: list[int] = typer.Option([1_000, 10_000, 100_000]),
+    repeat: int = 20,
+    base_url: Optional[str] = None,
+    track: Optional[str] = typer.Option(None, help="username/slug, with --base-url"),
+):
+    if base_url is not None and track is not None:
+        results = live(base_url, track, repeat)
+    else:
+        results = offline(points, repeat)
+
+    typer.echo(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    app()
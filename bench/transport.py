@@ -0,0 +1,113 @@
+import gzip
+import json
+from pathlib import Path
+
+import numpy as np
+import shapely
+import typer
+
+from app.lod import LOD_TIERS, lod_decimals
+from bench.render import synthetic_track_wkb
+
+app = typer.Typer()
+
+
+def encode_polyline(coords: np.ndarray, precision: int) -> str:
+    # same as ST_AsEncodedPolyline, lat first
+    ints = np.round(coords[:, ::-1] * 10**precision).astype(np.int64)
+    deltas = np.diff(ints, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1).ravel()
+
+    chars = []
+    for value in values.tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+
+    return "".join(chars)
+
+
+def geojson_feature(geometry, precision: int) -> dict:
+    return {
+        "type": "Feature",
+        "properties": {"slug": "track", "username": "someone"},
+        "geometry": {
+            "type": "MultiLineString",
+            "coordinates": [
+                np.round(shapely.get_coordinates(part), precision).tolist()
+                for part in shapely.get_parts(geometry)
+            ],
+        },
+    }
+
+
+def polyline_feature(geometry, precision: int) -> dict:
+    return {
+        "properties": {"slug": "track", "username": "someone"},
+        "polylines": " ".join(
+            encode_polyline(shapely.get_coordinates(part), precision)
+            for part in shapely.get_parts(geometry)
+        ),
+    }
+
+
+def ndjson(features) -> bytes:
+    return "".join(json.dumps(feature) + "\n" for feature in features).encode()
+
+
+@app.command()
+def main(
+    tracks: int = 100,
+    points: int = 10_000,
+    output_dir: Path = Path("bench_output/transport"),
+):
+    geometries = [
+        shapely.from_wkb(synthetic_track_wkb(points, segments=2, seed=seed))
+        for seed in range(tracks)
+    ]
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    results = []
+
+    for tier, (_, _, tolerance) in enumerate(LOD_TIERS):
+        precision = lod_decimals(tier)
+        simplified = [
+            shapely.simplify(geometry, tolerance) if tolerance else geometry
+            for geometry in geometries
+        ]
+
+        payloads = {
+            # what ?format=json sent before tiers existed, 9 digits
+            "geojson-full-precision": ndjson(
+                geojson_feature(geometry, 9) for geometry in simplified
+            ),
+            "geojson": ndjson(
+                geojson_feature(geometry, precision) for geometry in simplified
+            ),
+            "polyline": ndjson(
+                polyline_feature(geometry, precision) for geometry in simplified
+            ),
+        }
+
+        for name, payload in payloads.items():
+            path = output_dir / f"tier{tier}-{name}.ndjson"
+            path.write_bytes(payload)
+
+            results.append(
+                {
+                    "tier": tier,
+                    "precision": precision,
+                    "format": name,
+                    "bytes": len(payload),
+                    "gzip_bytes": len(gzip.compress(payload)),
+                    "path": str(path),
+                }
+            )
+
+    (output_dir / "results.json").write_text(json.dumps(results, indent=2))
+    typer.echo(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    app()
@@ -1,4 +1,8 @@
 import asyncio
+import os
+from pathlib import Path
+from typing import List, Optional
+
 import typer
 
 app = typer.Typer()
@@ -40,6 +44,15 @@ def download_javascript_libs():
         with open(static_dir / "turf.min.js", "wb") as f:
             f.write(req.content)
 
+        vectorgrid = (
+            "https://unpkg.com/leaflet.vectorgrid@1.3.0/dist/"
+            "Leaflet.VectorGrid.bundled.min.js"
+        )
+
+        req = httpx.get(vectorgrid)
+        with open(static_dir / "Leaflet.VectorGrid.bundled.min.js", "wb") as f:
+            f.write(req.content)
+
         htmx = "https://unpkg.com/htmx.org@1.9.12/dist/htmx.min.js"
 
         req = httpx.get(htmx)
@@ -47,6 +60,14 @@ def download_javascript_libs():
             f.write(req.content)
 
 
+@app.command()
+def compress_static(directory: Path = Path("static")):
+    from app.static_files import compress_static
+
+    for path, encoding, size, compressed in compress_static(directory):
+        typer.echo(f"{path} {encoding}: {size} -> {compressed} bytes")
+
+
 @app.command()
 def run_dev_api(host: str = "127.0.0.1"):
     import uvicorn
@@ -67,10 +88,43 @@ def display_settings():
     typer.echo(settings.model_dump_json(indent=2))
 
 
+@app.command()
+def import_time(module: str = "app.main", top: int = 20, budget_ms: float = 0):
+    import subprocess
+    import sys
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    rows = []
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+
+    total_ms = rows[-1][0] / 1000 if rows else 0
+
+    typer.echo(f"{'cumulative ms':>14} {'self ms':>10}  module")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:top]:
+        typer.echo(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>10.1f}  {name}")
+
+    typer.echo(f"\nimporting {module} took {total_ms:.1f}ms")
+
+    if budget_ms and total_ms > budget_ms:
+        typer.echo(f"over the budget of {budget_ms:.1f}ms", err=True)
+        raise typer.Exit(code=1)
+
+
 @app.command()
 def create_user(username: str, email: str, password: str, role: str):
-    from app.db import get_connection
-    from app.main import create_user
+    from app.db import get_connection, create_user
 
     async def run():
         connection = await get_connection()
@@ -80,5 +134,99 @@ def create_user(username: str, email: str, password: str, role: str):
     asyncio.run(run())
 
 
+@app.command()
+def import_tracks(
+    username: str,
+    paths: List[Path],
+    ignore_quota: bool = False,
+    workers: Optional[int] = None,
+):
+    import time
+
+    from app.batch import insert_batch, prepare_batch
+    from app.db import get_connection
+    from app.render_pool import start_render_pool, stop_render_pool
+
+    files = []
+
+    for path in paths:
+        if path.is_dir():
+            files.extend(
+                (file.name, file.read_bytes())
+                for file in sorted(path.rglob("*"))
+                if file.suffix.lower() in (".gpx", ".zip")
+            )
+        else:
+            files.append((path.name, path.read_bytes()))
+
+    async def run():
+        start = time.perf_counter()
+
+        # the pool also adds the tracks to the heatmap as they're inserted
+        pool_workers = workers or os.cpu_count()
+        start_render_pool(pool_workers)
+        try:
+            items = await prepare_batch(files, pool_workers)
+
+            connection = await get_connection()
+            try:
+                user_id = await connection.fetchval(
+                    "SELECT id FROM users WHERE username = $1", username
+                )
+
+                if user_id is None:
+                    typer.echo(f"No user named {username}", err=True)
+                    raise typer.Exit(code=1)
+
+                items = await insert_batch(
+                    connection, user_id, items, check_quota=not ignore_quota
+                )
+            finally:
+                await connection.close()
+        finally:
+            stop_render_pool()
+
+        for item in items:
+            if item.slug:
+                typer.echo(f"{item.filename} -> {item.slug}")
+            else:
+                typer.echo(f"{item.filename} failed: {item.error}", err=True)
+
+        imported = sum(1 for item in items if item.slug)
+        typer.echo(
+            f"\nimported {imported}/{len(items)} tracks "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+
+    asyncio.run(run())
+
+
+@app.command()
+def rebuild_heatmap(workers: Optional[int] = None):
+    import time
+
+    from app.db import get_connection
+    from app.heatmap import rebuild_heatmap
+    from app.render_pool import start_render_pool, stop_render_pool
+
+    async def run():
+        start = time.perf_counter()
+
+        start_render_pool(workers or os.cpu_count())
+        connection = await get_connection()
+        try:
+            tracks = await rebuild_heatmap(connection)
+        finally:
+            await connection.close()
+            stop_render_pool()
+
+        typer.echo(
+            f"counted {tracks} tracks into the heatmap "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+
+    asyncio.run(run())
+
+
 if __name__ == "__main__":
     app()
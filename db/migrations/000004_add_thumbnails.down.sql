@@ -0,0 +1,7 @@
+BEGIN;
+
+DROP TABLE thumbnails;
+
+ALTER TABLE tracks DROP COLUMN geometry_hash;
+
+COMMIT;
@@ -0,0 +1,16 @@
+BEGIN;
+
+ALTER TABLE tracks ADD COLUMN geometry_hash TEXT GENERATED ALWAYS AS (md5(ST_AsEWKB(geometry))) STORED;
+
+CREATE TABLE thumbnails (
+    user_id INTEGER NOT NULL,
+    slug TEXT NOT NULL,
+    geometry_hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    png BYTEA NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, slug, geometry_hash, params),
+    FOREIGN KEY (user_id, slug) REFERENCES tracks (user_id, slug) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+COMMIT;
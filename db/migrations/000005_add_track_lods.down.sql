@@ -0,0 +1,8 @@
+BEGIN;
+
+ALTER TABLE tracks
+    DROP COLUMN geometry_lod0,
+    DROP COLUMN geometry_lod1,
+    DROP COLUMN geometry_lod2;
+
+COMMIT;
@@ -0,0 +1,11 @@
+BEGIN;
+
+ALTER TABLE tracks
+    ADD COLUMN geometry_lod0 GEOMETRY(MULTILINESTRING, 4326)
+        GENERATED ALWAYS AS (ST_Multi(ST_SimplifyPreserveTopology(geometry, 0.01))) STORED,
+    ADD COLUMN geometry_lod1 GEOMETRY(MULTILINESTRING, 4326)
+        GENERATED ALWAYS AS (ST_Multi(ST_SimplifyPreserveTopology(geometry, 0.001))) STORED,
+    ADD COLUMN geometry_lod2 GEOMETRY(MULTILINESTRING, 4326)
+        GENERATED ALWAYS AS (ST_Multi(ST_SimplifyPreserveTopology(geometry, 0.0001))) STORED;
+
+COMMIT;
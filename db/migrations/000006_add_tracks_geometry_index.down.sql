@@ -0,0 +1,5 @@
+BEGIN;
+
+DROP INDEX tracks_geometry_idx;
+
+COMMIT;
@@ -0,0 +1,5 @@
+BEGIN;
+
+CREATE INDEX tracks_geometry_idx ON tracks USING GIST (geometry);
+
+COMMIT;
@@ -0,0 +1,7 @@
+BEGIN;
+
+DROP TRIGGER tracks_changed ON tracks;
+
+DROP FUNCTION notify_tracks_changed;
+
+COMMIT;
@@ -0,0 +1,19 @@
+BEGIN;
+
+CREATE FUNCTION notify_tracks_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('tracks_changed', OLD.user_id::text);
+    ELSE
+        PERFORM pg_notify('tracks_changed', NEW.user_id::text);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER tracks_changed
+AFTER INSERT OR UPDATE OR DELETE ON tracks
+FOR EACH ROW EXECUTE FUNCTION notify_tracks_changed();
+
+COMMIT;
@@ -0,0 +1,11 @@
+BEGIN;
+
+ALTER TABLE tracks
+    DROP COLUMN polyline_lod0,
+    DROP COLUMN polyline_lod1,
+    DROP COLUMN polyline_lod2,
+    DROP COLUMN polyline;
+
+DROP FUNCTION encoded_polylines;
+
+COMMIT;
@@ -0,0 +1,22 @@
+BEGIN;
+
+-- one google encoded polyline per linestring, separated by spaces which the
+-- encoding never uses
+CREATE FUNCTION encoded_polylines(geom GEOMETRY, precision INTEGER) RETURNS TEXT AS $$
+    SELECT string_agg(ST_AsEncodedPolyline(dump.geom, precision), ' ' ORDER BY dump.path)
+    FROM ST_Dump(geom) AS dump
+$$ LANGUAGE SQL IMMUTABLE STRICT PARALLEL SAFE;
+
+-- generated columns can't reference each other, so the simplification from
+-- 000005_add_track_lods is repeated here
+ALTER TABLE tracks
+    ADD COLUMN polyline_lod0 TEXT
+        GENERATED ALWAYS AS (encoded_polylines(ST_SimplifyPreserveTopology(geometry, 0.01), 3)) STORED,
+    ADD COLUMN polyline_lod1 TEXT
+        GENERATED ALWAYS AS (encoded_polylines(ST_SimplifyPreserveTopology(geometry, 0.001), 4)) STORED,
+    ADD COLUMN polyline_lod2 TEXT
+        GENERATED ALWAYS AS (encoded_polylines(ST_SimplifyPreserveTopology(geometry, 0.0001), 5)) STORED,
+    ADD COLUMN polyline TEXT
+        GENERATED ALWAYS AS (encoded_polylines(geometry, 6)) STORED;
+
+COMMIT;
@@ -0,0 +1,7 @@
+BEGIN;
+
+DROP TABLE ingest_jobs;
+
+DROP TABLE ingest_job_status;
+
+COMMIT;
@@ -0,0 +1,30 @@
+BEGIN;
+
+CREATE TABLE ingest_job_status (
+    id TEXT PRIMARY KEY
+);
+
+INSERT INTO ingest_job_status (id) VALUES ('queued');
+INSERT INTO ingest_job_status (id) VALUES ('running');
+INSERT INTO ingest_job_status (id) VALUES ('done');
+INSERT INTO ingest_job_status (id) VALUES ('failed');
+
+CREATE TABLE ingest_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE ON UPDATE CASCADE NOT NULL,
+    filename TEXT NOT NULL,
+    gpx BYTEA,
+    status TEXT REFERENCES ingest_job_status (id) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    slug TEXT,
+    error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX ingest_jobs_pending_idx ON ingest_jobs (id) WHERE status IN ('queued', 'running');
+
+CREATE INDEX ingest_jobs_user_id_idx ON ingest_jobs (user_id);
+
+COMMIT;
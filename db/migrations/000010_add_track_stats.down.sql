@@ -0,0 +1,5 @@
+BEGIN;
+
+DROP TABLE track_stats;
+
+COMMIT;
@@ -0,0 +1,47 @@
+BEGIN;
+
+CREATE TABLE track_stats (
+    user_id INTEGER NOT NULL,
+    slug TEXT NOT NULL,
+    -- metres, measured on the spheroid
+    distance DOUBLE PRECISION NOT NULL,
+    points INTEGER NOT NULL,
+    minx DOUBLE PRECISION NOT NULL,
+    miny DOUBLE PRECISION NOT NULL,
+    maxx DOUBLE PRECISION NOT NULL,
+    maxy DOUBLE PRECISION NOT NULL,
+    start_point GEOMETRY(POINT, 4326) NOT NULL,
+    end_point GEOMETRY(POINT, 4326) NOT NULL,
+    -- only known when the gpx had timestamps / elevations
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    duration INTERVAL GENERATED ALWAYS AS (finished_at - started_at) STORED,
+    elevation_gain DOUBLE PRECISION,
+    PRIMARY KEY (user_id, slug),
+    FOREIGN KEY (user_id, slug) REFERENCES tracks (user_id, slug) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+CREATE INDEX track_stats_distance_idx ON track_stats (distance DESC);
+CREATE INDEX track_stats_duration_idx ON track_stats (duration DESC NULLS LAST);
+CREATE INDEX track_stats_elevation_gain_idx ON track_stats (elevation_gain DESC NULLS LAST);
+CREATE INDEX track_stats_started_at_idx ON track_stats (started_at DESC NULLS LAST);
+
+-- existing tracks were stored without time or elevation, so only what can
+-- be worked out from the geometry is filled in for them
+INSERT INTO track_stats (
+    user_id, slug, distance, points, minx, miny, maxx, maxy, start_point, end_point
+)
+SELECT
+    user_id,
+    slug,
+    ST_Length(geometry::geography),
+    ST_NPoints(geometry),
+    ST_XMin(geometry),
+    ST_YMin(geometry),
+    ST_XMax(geometry),
+    ST_YMax(geometry),
+    ST_StartPoint(ST_GeometryN(geometry, 1)),
+    ST_EndPoint(ST_GeometryN(geometry, ST_NumGeometries(geometry)))
+FROM tracks;
+
+COMMIT;
@@ -0,0 +1,18 @@
+BEGIN;
+
+DROP INDEX tracks_created_at_idx;
+DROP INDEX tracks_user_id_created_at_idx;
+DROP INDEX tracks_activity_created_at_idx;
+DROP INDEX tracks_name_idx;
+
+DROP INDEX track_stats_distance_idx;
+DROP INDEX track_stats_duration_idx;
+DROP INDEX track_stats_elevation_gain_idx;
+DROP INDEX track_stats_started_at_idx;
+
+CREATE INDEX track_stats_distance_idx ON track_stats (distance DESC);
+CREATE INDEX track_stats_duration_idx ON track_stats (duration DESC NULLS LAST);
+CREATE INDEX track_stats_elevation_gain_idx ON track_stats (elevation_gain DESC NULLS LAST);
+CREATE INDEX track_stats_started_at_idx ON track_stats (started_at DESC NULLS LAST);
+
+COMMIT;
@@ -0,0 +1,21 @@
+BEGIN;
+
+-- listings page through tracks by (sort value, user_id, slug), one index per
+-- sort so any page is a short index range scan
+
+CREATE INDEX tracks_created_at_idx ON tracks (created_at, user_id, slug);
+CREATE INDEX tracks_user_id_created_at_idx ON tracks (user_id, created_at, slug);
+CREATE INDEX tracks_activity_created_at_idx ON tracks (activity, created_at, user_id, slug);
+CREATE INDEX tracks_name_idx ON tracks (name, user_id, slug);
+
+DROP INDEX track_stats_distance_idx;
+DROP INDEX track_stats_duration_idx;
+DROP INDEX track_stats_elevation_gain_idx;
+DROP INDEX track_stats_started_at_idx;
+
+CREATE INDEX track_stats_distance_idx ON track_stats (distance, user_id, slug);
+CREATE INDEX track_stats_duration_idx ON track_stats ((COALESCE(duration, INTERVAL '0')), user_id, slug);
+CREATE INDEX track_stats_elevation_gain_idx ON track_stats ((COALESCE(elevation_gain, -1)), user_id, slug);
+CREATE INDEX track_stats_started_at_idx ON track_stats ((COALESCE(started_at, TIMESTAMP '1970-01-01')), user_id, slug);
+
+COMMIT;
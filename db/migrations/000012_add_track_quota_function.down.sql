@@ -0,0 +1,5 @@
+BEGIN;
+
+DROP FUNCTION track_quota_remaining;
+
+COMMIT;
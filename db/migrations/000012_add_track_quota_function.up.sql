@@ -0,0 +1,20 @@
+BEGIN;
+
+-- tracks a user can still add, counting jobs that are still to be processed.
+-- locking the user first serialises everyone adding tracks for them, and as
+-- this is volatile the counts are taken after the lock, so they include
+-- whatever the previous holder committed
+CREATE FUNCTION track_quota_remaining(for_user INTEGER, quota INTEGER) RETURNS INTEGER AS $$
+BEGIN
+    PERFORM 1 FROM users WHERE id = for_user FOR UPDATE;
+
+    RETURN quota
+        - (SELECT COUNT(*) FROM tracks WHERE user_id = for_user)
+        - (
+            SELECT COUNT(*) FROM ingest_jobs
+            WHERE user_id = for_user AND status IN ('queued', 'running')
+        );
+END;
+$$ LANGUAGE plpgsql VOLATILE;
+
+COMMIT;
@@ -0,0 +1,7 @@
+BEGIN;
+
+DROP TABLE heatmap_tiles;
+
+DROP SEQUENCE heatmap_tile_versions;
+
+COMMIT;
@@ -0,0 +1,19 @@
+BEGIN;
+
+-- versions only go up, even across a rebuild, so a tile's (z, x, y, version)
+-- always names the same counts and can be cached on
+CREATE SEQUENCE heatmap_tile_versions;
+
+-- how many tracks pass through each cell of a web mercator tile, as a zlib
+-- compressed 256x256 grid of little endian uint16 counts. kept up to date by
+-- the app as tracks are written, tiles nothing passes through have no row
+CREATE TABLE heatmap_tiles (
+    z SMALLINT NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    counts BYTEA,
+    version BIGINT NOT NULL DEFAULT nextval('heatmap_tile_versions'),
+    PRIMARY KEY (z, x, y)
+);
+
+COMMIT;
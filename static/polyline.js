@@ -0,0 +1,41 @@
+// decodes the space separated google encoded polylines from ?format=polyline
+// into one array of [lat, lng] pairs per line
+export const decodePolylines = (encoded, precision) => {
+  const factor = Math.pow(10, precision);
+
+  return encoded.split(" ").map((polyline) => {
+    const latlngs = [];
+    let index = 0;
+    let lat = 0;
+    let lng = 0;
+
+    while (index < polyline.length) {
+      let result = 0;
+      let shift = 0;
+      let byte;
+
+      do {
+        byte = polyline.charCodeAt(index++) - 63;
+        result |= (byte & 0x1f) << shift;
+        shift += 5;
+      } while (byte >= 0x20);
+
+      lat += result & 1 ? ~(result >> 1) : result >> 1;
+
+      result = 0;
+      shift = 0;
+
+      do {
+        byte = polyline.charCodeAt(index++) - 63;
+        result |= (byte & 0x1f) << shift;
+        shift += 5;
+      } while (byte >= 0x20);
+
+      lng += result & 1 ? ~(result >> 1) : result >> 1;
+
+      latlngs.push([lat / factor, lng / factor]);
+    }
+
+    return latlngs;
+  });
+};
@@ -1,44 +1,240 @@
 import * as L from "/static/leaflet-src.esm.js";
+import { decodePolylines } from "/static/polyline.js";
 
 let map;
 let layerGroup;
+let tileLayer;
+let heatmapLayer;
+let layersControl;
+let source;
+let tracks = [];
+let lod;
+let loadedBounds;
+let latestRequest = 0;
 
-const setup = async () => {
-  const response = await fetch("?format=json");
-  const data = await response.json();
-  console.log({ data });
+const trackStyle = {
+  color: "red",
+  weight: 3,
+};
 
-  const tracks = [];
-  const features = [];
-
-  data.tracks.map(({ geometry: geometryString, slug, username }) => {
-    const geometry = JSON.parse(geometryString);
-    features.push(geometry);
-
-    const layer = L.geoJSON(geometry, {
-      style: (feature) => {
-        return {
-          color: "red",
-        };
-      },
-    }).bindPopup((layer) => {
-      return "foo";
-    });
+// Leaflet.VectorGrid is a classic script that extends a global L, while we
+// use the esm build of leaflet, so hand it a copy of the module to extend.
+// the page passes in its fingerprinted url, which an import map can't do for
+// a classic script
+const loadVectorGrid = (url) =>
+  new Promise((resolve, reject) => {
+    if (window.L && window.L.vectorGrid) {
+      resolve(window.L);
+      return;
+    }
+
+    window.L = Object.assign({}, L);
+
+    const script = document.createElement("script");
+    script.src = url;
+    script.onload = () => resolve(window.L);
+    script.onerror = reject;
+    document.head.appendChild(script);
+  });
+
+const fetchData = async (params) => {
+  const response = await fetch(`?${new URLSearchParams(params)}`);
+  return await response.json();
+};
+
+const trackLayer = (feature, precision) => {
+  return L.polyline(
+    decodePolylines(feature.polylines, precision),
+    trackStyle
+  ).bindPopup((layer) => {
+    return "foo";
+  });
+};
 
-    tracks.push({
+// tracks arrive as one encoded feature per line, draw each one as soon as
+// it shows up and only swap out the old layers once the stream is done
+const streamTracks = async (zoom, bounds) => {
+  const request = ++latestRequest;
+
+  const params = new URLSearchParams({
+    format: "polyline",
+    zoom,
+    bbox: [
+      bounds.getWest(),
+      bounds.getSouth(),
+      bounds.getEast(),
+      bounds.getNorth(),
+    ].join(","),
+  });
+
+  const response = await fetch(`?${params}`);
+
+  if (request !== latestRequest || !map) {
+    return;
+  }
+
+  const precision = Number(response.headers.get("X-Polyline-Precision"));
+  const group = L.layerGroup().addTo(map);
+  const streamed = [];
+
+  const addLine = (line) => {
+    if (!line) {
+      return;
+    }
+
+    const feature = JSON.parse(line);
+    const layer = trackLayer(feature, precision);
+
+    group.addLayer(layer);
+    streamed.push({
       layer,
-      slug,
-      username,
+      slug: feature.properties.slug,
+      username: feature.properties.username,
     });
+  };
+
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+
+    if (request !== latestRequest || !map) {
+      reader.cancel();
+      group.remove();
+      return;
+    }
+
+    if (done) {
+      break;
+    }
+
+    buffer += value;
+
+    const lines = buffer.split("\n");
+    buffer = lines.pop();
+    lines.map(addLine);
+  }
+
+  addLine(buffer);
+
+  layerGroup.remove();
+  layerGroup = group;
+  tracks = streamed;
+  loadedBounds = bounds;
+  lod = {
+    tier: Number(response.headers.get("X-Lod-Tier")),
+    min_zoom: Number(response.headers.get("X-Lod-Min-Zoom")),
+    max_zoom: Number(response.headers.get("X-Lod-Max-Zoom")),
+  };
+};
+
+const showTiles = async () => {
+  tracks = [];
+  layerGroup.clearLayers();
+
+  if (tileLayer) {
+    tileLayer.redraw();
+    return;
+  }
+
+  const { vectorGridUrl } =
+    document.querySelector("[data-map-source]").dataset;
+  const { vectorGrid } = await loadVectorGrid(vectorGridUrl);
+
+  tileLayer = vectorGrid.protobuf("/lon/tiles/{z}/{x}/{y}.mvt", {
+    maxNativeZoom: 19,
+    vectorTileLayerStyles: {
+      tracks: trackStyle,
+    },
   });
 
-  const center = JSON.parse(data.aggregates.center).coordinates;
-  center.reverse();
+  tileLayer.addTo(map);
+};
+
+// lets the tracks be swapped for, or drawn over, how many tracks pass
+// through each spot, which reads better than thousands of lines at low zoom
+const showHeatmapToggle = (maxZoom) => {
+  if (layersControl) {
+    return;
+  }
 
-  const extent = JSON.parse(data.aggregates.extent);
+  heatmapLayer = L.tileLayer("/lon/heatmap/{z}/{x}/{y}.png", {
+    maxNativeZoom: maxZoom,
+    maxZoom: 19,
+  });
+
+  layersControl = L.control
+    .layers(null, { tracks: tileLayer, heatmap: heatmapLayer })
+    .addTo(map);
+};
+
+const hideHeatmapToggle = () => {
+  if (!layersControl) {
+    return;
+  }
+
+  layersControl.remove();
+  heatmapLayer.remove();
+  layersControl = undefined;
+  heatmapLayer = undefined;
+};
+
+const onMoveEnd = async () => {
+  if (source !== "json") {
+    return;
+  }
+
+  const zoom = map.getZoom();
+  const viewport = map.getBounds();
+
+  if (
+    lod &&
+    zoom >= lod.min_zoom &&
+    zoom <= lod.max_zoom &&
+    loadedBounds &&
+    loadedBounds.contains(viewport)
+  ) {
+    return;
+  }
+
+  // fetch a bit more than what's visible so small pans don't refetch
+  await streamTracks(zoom, viewport.pad(0.5));
+};
+
+const trackBounds = (elm) => {
+  const { trackUsername, trackSlug, trackBounds } = elm.dataset;
+
+  if (trackBounds) {
+    const [minx, miny, maxx, maxy] = trackBounds.split(",").map(Number);
+    return L.latLngBounds([miny, minx], [maxy, maxx]);
+  }
+
+  const track = tracks.find(
+    ({ username, slug }) => username === trackUsername && slug === trackSlug
+  );
+
+  return track && track.layer.getBounds();
+};
+
+const setup = async () => {
+  const { mapSource, heatmapMaxZoom } =
+    document.querySelector("[data-map-source]").dataset;
+  source = mapSource;
+
+  const request = ++latestRequest;
+  const data = await fetchData({ format: "aggregates" });
+  console.log({ data });
+
+  if (request !== latestRequest) {
+    return;
+  }
 
   if (!map) {
     map = L.map("map");
+    tileLayer = undefined;
+    heatmapLayer = undefined;
+    layersControl = undefined;
 
     L.tileLayer("https://tile.openstreetmap.org/{z}/{x}/{y}.png", {
       maxZoom: 19,
@@ -48,45 +244,64 @@ const setup = async () => {
 
     layerGroup = L.layerGroup();
     layerGroup.addTo(map);
+
+    map.on("moveend", onMoveEnd);
   }
 
-  map.setView(center, 10).fitBounds([
-    [extent.coordinates[0][0][1], extent.coordinates[0][0][0]],
-    [extent.coordinates[0][2][1], extent.coordinates[0][2][0]],
-  ]);
+  lod = undefined;
+  loadedBounds = undefined;
 
-  layerGroup.clearLayers();
+  if (source === "tiles") {
+    await showTiles();
+    showHeatmapToggle(Number(heatmapMaxZoom));
+  } else {
+    tracks = [];
+    layerGroup.clearLayers();
+    hideHeatmapToggle();
 
-  tracks.map(({ layer }) => {
-    layerGroup.addLayer(layer);
-  });
+    if (tileLayer) {
+      tileLayer.remove();
+      tileLayer = undefined;
+    }
+  }
 
-  Array.from(document.querySelectorAll("a[data-track]")).map((elm) => {
-    const { trackUsername, trackSlug } = elm.dataset;
+  if (data.aggregates.extent) {
+    const center = JSON.parse(data.aggregates.center).coordinates;
+    center.reverse();
 
-    const zoomToTrack = () => {
-      const track = tracks.find(
-        ({ username, slug }) => username === trackUsername && slug === trackSlug
-      );
+    const extent = JSON.parse(data.aggregates.extent);
 
-      if (!track) {
-        console.error("Track not found");
-        return;
-      }
+    map.setView(center, 10).fitBounds([
+      [extent.coordinates[0][0][1], extent.coordinates[0][0][0]],
+      [extent.coordinates[0][2][1], extent.coordinates[0][2][0]],
+    ]);
+  } else {
+    map.setView([0, 0], 2);
+  }
+};
 
-      map.flyToBounds(track.layer.getBounds());
-    };
+// listings grow as they're scrolled, so listen on the document rather than
+// on each link that happens to be there when the page loads
+const zoomToTrack = (event) => {
+  const elm = event.target.closest && event.target.closest("a[data-track]");
 
-    elm.addEventListener("mouseover", (event) => {
-      zoomToTrack();
-    });
+  if (!elm || !map) {
+    return;
+  }
 
-    elm.addEventListener("focus", (event) => {
-      zoomToTrack();
-    });
-  });
+  const bounds = trackBounds(elm);
+
+  if (!bounds) {
+    console.error("Track not found");
+    return;
+  }
+
+  map.flyToBounds(bounds);
 };
 
+document.addEventListener("mouseover", zoomToTrack);
+document.addEventListener("focusin", zoomToTrack);
+
 document.addEventListener("DOMContentLoaded", () => {
   if (!document.querySelector("#map")) {
     return;
@@ -94,7 +309,13 @@ document.addEventListener("DOMContentLoaded", () => {
   setup();
 });
 
-window.addEventListener("htmx:afterSwap", () => {
+window.addEventListener("htmx:afterSwap", (event) => {
+  // only a page navigation needs the map set up again, not the next page of
+  // a listing being swapped in
+  if (event.detail.target !== document.body) {
+    return;
+  }
+
   if (!document.querySelector("#map")) {
     if (map) {
       map.remove();